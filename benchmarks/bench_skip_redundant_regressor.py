@@ -0,0 +1,45 @@
+"""
+==================================================
+Benchmark of the fit time saved by skipping the
+redundant regression trees on the credit dataset
+==================================================
+
+Without sample weights, the regression trees of SkopeRules are grown on the
+same binary target as the classification trees and produce the same rules.
+This benchmark compares the fit time and the selected rules of SkopeRules
+with and without ``skip_redundant_regressor``.
+"""
+
+from time import time
+
+import numpy as np
+from sklearn.utils import shuffle
+
+from skrules import SkopeRules
+from skrules.datasets import load_credit_data
+
+print(__doc__)
+
+dataset = load_credit_data()
+X, y = shuffle(np.array(dataset.data.drop(columns=['ID'])), dataset.target,
+               random_state=1)
+n_train = X.shape[0] // 2
+
+for max_depth in [3, [1, 2, 3, 4]]:
+    rules = {}
+    for skip in [False, True]:
+        clf = SkopeRules(max_depth=max_depth,
+                         n_estimators=30,
+                         precision_min=0.3,
+                         recall_min=0.02,
+                         skip_redundant_regressor=skip,
+                         random_state=1)
+        t0 = time()
+        clf.fit(X[:n_train], y[:n_train])
+        fit_time = time() - t0
+        rules[skip] = [(r, p[:2]) for r, p in clf.rules_]
+        print("max_depth=%s skip_redundant_regressor=%s: %d trees, "
+              "fit in %.2fs, %d rules"
+              % (max_depth, skip, len(clf.estimators_), fit_time,
+                 len(clf.rules_)))
+    print("Same rules and performances: %s\n" % (rules[False] == rules[True]))
@@ -0,0 +1,112 @@
+import numbers
+
+import numpy as np
+
+from .rule import Rule
+
+
+class QuantileBinner:
+    """ Bin each feature into integer codes at its quantiles.
+
+    A value x of the feature j gets the code ``k`` when
+    ``bin_edges_[j][k - 1] < x <= bin_edges_[j][k]``, so that the rule
+    ``code <= k`` on the codes is the rule ``x <= bin_edges_[j][k]`` on the
+    values. Features with at most `n_bins` distinct values are binned at the
+    midpoints of their consecutive values, without loss.
+
+    Parameters
+    ----------
+
+    n_bins : int, optional (default=256)
+        The maximal number of bins of each feature, between 2 and 65536.
+        The codes are stored as uint8 up to 256 bins, as uint16 otherwise.
+
+    Attributes
+    ----------
+
+    bin_edges_ : list of arrays
+        The sorted upper edges of the bins of each feature (the last bin
+        being unbounded).
+
+    dtype_ : numpy dtype
+        The type of the codes.
+    """
+
+    def __init__(self, n_bins=256):
+        self.n_bins = n_bins
+
+    def fit(self, X):
+        """Compute the bin edges of each column of X.
+
+        Parameters
+        ----------
+        X : array, shape (n_samples, n_features)
+            The numerical samples.
+
+        Returns
+        -------
+        self : object
+            Returns self.
+        """
+        if not (isinstance(self.n_bins, numbers.Integral)
+                and 2 <= self.n_bins <= 65536):
+            raise ValueError("n_bins should be an integer in [2, 65536], got"
+                             " %r" % self.n_bins)
+
+        percentiles = np.linspace(0, 100, self.n_bins + 1)[1:-1]
+        self.bin_edges_ = []
+        for column in np.asarray(X).T:
+            values = np.unique(column)
+            if len(values) <= self.n_bins:
+                edges = (values[:-1] + values[1:]) / 2.
+            else:
+                edges = np.unique(np.percentile(column, percentiles,
+                                                method='midpoint'))
+            self.bin_edges_.append(edges)
+        self.dtype_ = np.dtype(np.uint8 if self.n_bins <= 256
+                               else np.uint16)
+        return self
+
+    def transform(self, X):
+        """Replace the values of X by their bin codes.
+
+        Returns
+        -------
+        codes : array of uint8 or uint16, shape (n_samples, n_features)
+        """
+        X = np.asarray(X)
+        codes = np.empty(X.shape, dtype=self.dtype_, order='F')
+        for j in range(len(self.bin_edges_)):
+            codes[:, j] = self.transform_column(X[:, j], j)
+        return codes
+
+    def transform_column(self, column, feature):
+        """Replace the values of the column of the feature by their codes.
+
+        Returns
+        -------
+        codes : array of uint8 or uint16, shape (n_samples,)
+        """
+        return np.searchsorted(self.bin_edges_[feature], column).astype(
+            self.dtype_)
+
+    def inverse_transform_rule(self, rule):
+        """Translate a rule on the codes into the same rule on the values.
+
+        Parameters
+        ----------
+        rule : Rule
+            A rule of '<=' and '>' terms on the codes, whose features are
+            column indices.
+
+        Returns
+        -------
+        rule : Rule
+            The rule selecting the same samples on the values, each
+            threshold being a bin edge. The ``feature == feature`` term of
+            the rule selecting all the samples is kept as such.
+        """
+        return Rule([(feature, symbol, value) if symbol == '=='
+                     else (feature, symbol,
+                           self.bin_edges_[feature][int(np.floor(value))])
+                     for feature, symbol, value in rule.terms], rule.args)
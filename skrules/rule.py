@@ -1,13 +1,27 @@
 import re
+from functools import lru_cache
+
+import numpy as np
+
+
+@lru_cache(maxsize=16)
+def _feature_names_pattern(feature_names):
+    """The compiled regex matching any of the feature names as a word."""
+    return re.compile('|'.join(r'\b%s\b' % re.escape(s)
+                               for s in feature_names))
 
 
 def replace_feature_name(rule, replace_dict):
+    """Replace the feature names of a free-form rule string.
+
+    The regex matching the names of `replace_dict` is compiled once for a
+    given set of names. Structured rules are rendered without any regex by
+    ``RuleRenderer``.
+    """
     def replace(match):
         return replace_dict[match.group(0)]
 
-    rule = re.sub('|'.join(r'\b%s\b' % re.escape(s) for s in replace_dict),
-                  replace, rule)
-    return rule
+    return _feature_names_pattern(tuple(replace_dict)).sub(replace, rule)
 
 
 class Rule:
@@ -17,54 +31,169 @@ class Rule:
     Parameters
     ----------
 
-    rule : str
-        The logical rule that is interpretable by a pandas query.
+    rule : str or list of tuples (feature, symbol, threshold)
+        The logical rule that is interpretable by a pandas query, or its
+        terms as emitted by a tree, in which case features can be column
+        indices and thresholds floats.
 
     args : object, optional
         Arguments associated to the rule, it is not used for factorization
         but it takes part of the output when the rule is converted to an array.
+
+    Attributes
+    ----------
+
+    features : tuple
+        The sorted features bounded by ``<=`` or ``>`` terms.
+
+    upper : array, shape (n_features,)
+        The upper bound (``<=``) of each feature, inf if unbounded.
+
+    lower : array, shape (n_features,)
+        The lower bound (``>``) of each feature, -inf if unbounded.
+
+    extra : tuple
+        The other terms, as sorted tuples ((feature, symbol), value).
     """
 
+    __slots__ = ('features', 'upper', 'lower', 'extra', 'args',
+                 '_key', '_hash')
+
     def __init__(self, rule, args=None):
-        self.rule = rule
         self.args = args
-        self.terms = [t.split(' ') for t in self.rule.split(' and ')]
-        self.agg_dict = {}
-        self.factorize()
-        self.rule = str(self)
+        if isinstance(rule, str):
+            terms = [t.split(' ') for t in rule.split(' and ')]
+        else:
+            terms = rule
+        self.factorize(terms)
 
     def __eq__(self, other):
-        return self.agg_dict == other.agg_dict
+        return isinstance(other, Rule) and self._key == other._key
 
     def __hash__(self):
-        # FIXME : Easier method ?
-        return hash(tuple(sorted(((i, j) for i, j in self.agg_dict.items()))))
-
-    def factorize(self):
-        for feature, symbol, value in self.terms:
-            if (feature, symbol) not in self.agg_dict:
-                if symbol != '==':
-                    self.agg_dict[(feature, symbol)] = str(float(value))
-                else:
-                    self.agg_dict[(feature, symbol)] = value
+        return self._hash
+
+    def factorize(self, terms):
+        """Aggregate the terms into a bound interval per feature.
+
+        The ``<=`` and ``>`` terms of a feature are reduced to an upper bound
+        in `upper` and a lower bound in `lower`, aligned with the sorted
+        `features`. Other terms are kept in `extra`.
+        """
+        upper, lower, extra = {}, {}, {}
+        for feature, symbol, value in terms:
+            if symbol == '<=':
+                upper[feature] = min(upper.get(feature, np.inf), float(value))
+            elif symbol == '>':
+                lower[feature] = max(lower.get(feature, -np.inf),
+                                     float(value))
+            elif symbol == '==':  # Handle the c0 == c0 case
+                extra[(feature, symbol)] = value
+            elif (feature, symbol) not in extra:
+                extra[(feature, symbol)] = float(value)
+            elif symbol[0] == '<':
+                extra[(feature, symbol)] = min(extra[(feature, symbol)],
+                                               float(value))
             else:
-                if symbol[0] == '<':
-                    self.agg_dict[(feature, symbol)] = str(min(
-                                float(self.agg_dict[(feature, symbol)]),
-                                float(value)))
-                elif symbol[0] == '>':
-                    self.agg_dict[(feature, symbol)] = str(max(
-                                float(self.agg_dict[(feature, symbol)]),
-                                float(value)))
-                else:  # Handle the c0 == c0 case
-                    self.agg_dict[(feature, symbol)] = value
+                extra[(feature, symbol)] = max(extra[(feature, symbol)],
+                                               float(value))
+
+        self.features = tuple(sorted(set(upper) | set(lower)))
+        upper = tuple(upper.get(f, np.inf) for f in self.features)
+        lower = tuple(lower.get(f, -np.inf) for f in self.features)
+        self.upper = np.array(upper, dtype=np.float64)
+        self.lower = np.array(lower, dtype=np.float64)
+        self.extra = tuple(sorted(extra.items()))
+        self._key = (self.features, upper, lower, self.extra)
+        self._hash = hash(self._key)
+
+    @property
+    def terms(self):
+        """The factorized terms, as tuples (feature, symbol, value)."""
+        terms = []
+        for feature, upper, lower in zip(self.features, self.upper,
+                                         self.lower):
+            if upper < np.inf:
+                terms.append((feature, '<=', float(upper)))
+            if lower > -np.inf:
+                terms.append((feature, '>', float(lower)))
+        terms += [(feature, symbol, value)
+                  for (feature, symbol), value in self.extra]
+        return terms
+
+    def to_string(self, feature_names=None, display_names=None):
+        """Render the rule as a string interpretable by a pandas query.
+
+        Parameters
+        ----------
+        feature_names : list or dict, optional
+            The name of each feature of the rule, looked up by the features
+            stored in the terms. If None, features are rendered as is.
+
+        display_names : list or dict, optional
+            If given, the features are rendered with these names, the terms
+            being still ordered by their `feature_names`.
+
+        Returns
+        -------
+        rule : str
+        """
+        def render(names):
+            def name(feature):
+                return str(feature) if names is None else str(names[feature])
+
+            return [(name(feature), symbol,
+                     name(value) if symbol == '==' and value == feature
+                     else str(value))
+                    for feature, symbol, value in self.terms]
+
+        keys = render(feature_names)
+        terms = keys if display_names is None else render(display_names)
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        return ' and '.join([' '.join(terms[k]) for k in order])
 
     def __iter__(self):
         yield str(self)
         yield self.args
 
     def __repr__(self):
-        return ' and '.join([' '.join(
-                [feature, symbol, str(self.agg_dict[(feature, symbol)])])
-                for feature, symbol in sorted(self.agg_dict.keys())
-                ])
+        return self.to_string()
+
+
+class RuleRenderer:
+    """ Render structured rules with the names of their features.
+
+    The names are looked up by the features of the terms, without parsing
+    the rules, and the strings of each rule are cached.
+
+    Parameters
+    ----------
+
+    feature_names : list or dict
+        The name of each feature, used to order the terms.
+
+    display_names : list or dict, optional
+        The name each feature is rendered with. If None, `feature_names`.
+    """
+
+    def __init__(self, feature_names, display_names=None):
+        self.feature_names = feature_names
+        self.display_names = display_names
+        self._cache = {}
+
+    def __call__(self, rule):
+        """Render a Rule.
+
+        Returns
+        -------
+        rule_string : str
+            The rule rendered with the `feature_names`.
+
+        display_string : str
+            The rule rendered with the `display_names`.
+        """
+        if rule not in self._cache:
+            self._cache[rule] = (
+                rule.to_string(self.feature_names),
+                rule.to_string(self.feature_names, self.display_names))
+        return self._cache[rule]
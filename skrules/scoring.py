@@ -0,0 +1,559 @@
+import numpy as np
+from scipy import sparse
+
+from .rule import Rule
+
+# Operator codes of the compiled terms.
+OP_LE = 0
+OP_GT = 1
+OP_LT = 2
+OP_GE = 3
+OP_EQ = 4
+OP_SELF = 5  # "c0 == c0" like terms, true for every non-missing value
+
+SYMBOL_TO_OP = {'<=': OP_LE, '>': OP_GT, '<': OP_LT, '>=': OP_GE,
+                '==': OP_EQ}
+
+# Number of rules evaluated densely before being packed (a multiple of 8).
+PACKED_BLOCK_RULES = 64
+
+# Number of bytes of term masks held in memory when evaluating packed rules.
+TERM_MASKS_SIZE = 1 << 24
+
+# Bits of every byte value, in little bit order.
+BYTE_BITS = np.unpackbits(np.arange(256, dtype=np.uint8)[:, np.newaxis],
+                          axis=1, bitorder='little')
+# Index of the lowest set bit of every byte value (0 for 0).
+BYTE_LOWEST_BIT = BYTE_BITS.argmax(axis=1)
+
+
+class CompiledRules:
+    """ A set of rules compiled into flat term arrays.
+
+    Each rule is a conjunction of terms ``feature op threshold``. Terms are
+    stored in parallel arrays so that rules can be evaluated as vectorized
+    boolean masks on a numerical array, without any string parsing or
+    DataFrame at prediction time.
+
+    Parameters
+    ----------
+
+    rules : list of str or Rule
+        The rules to compile.
+
+    feature_names : list of str, optional
+        The name of each column of the arrays the rules are evaluated on,
+        used to resolve the features of the rules. If None, the features of
+        the rules are column indices.
+
+    Attributes
+    ----------
+
+    n_rules : int
+        The number of compiled rules.
+
+    term_rule : array, shape (n_terms,)
+        The index of the rule each term belongs to.
+
+    term_feature : array, shape (n_terms,)
+        The column index each term is evaluated on.
+
+    term_op : array, shape (n_terms,)
+        The operator code of each term.
+
+    term_threshold : array, shape (n_terms,)
+        The threshold each term compares its column with.
+
+    term_unique : array, shape (n_terms,)
+        The index of each term in the unique terms, so that terms shared by
+        several rules are evaluated once.
+
+    unique_feature, unique_op, unique_threshold : arrays, shape (n_unique,)
+        The column, operator code and threshold of each unique term.
+
+    unique_rank : array, shape (n_unique,)
+        The position of the threshold of each unique '<=' or '>' term in the
+        thresholds of its feature, -1 for other terms.
+
+    feature_thresholds : dict
+        The sorted unique thresholds of the '<=' and '>' terms of each
+        column. A column is evaluated by ranking its values in these
+        thresholds once, each term then being a comparison of the ranks:
+        ``x <= thresholds[j]`` if and only if ``rank(x) <= j``.
+    """
+
+    def __init__(self, rules, feature_names=None):
+        if feature_names is not None:
+            feature_index = {name: i for i, name in enumerate(feature_names)}
+        term_rule, term_feature, term_op, term_threshold = [], [], [], []
+
+        for k, rule in enumerate(rules):
+            if not isinstance(rule, Rule):
+                rule = Rule(rule)
+            for feature, symbol, value in rule.terms:
+                if symbol == '==' and value == feature:
+                    op, threshold = OP_SELF, np.nan
+                else:
+                    op, threshold = SYMBOL_TO_OP[symbol], float(value)
+                term_rule.append(k)
+                term_feature.append(feature if feature_names is None
+                                    else feature_index[feature])
+                term_op.append(op)
+                term_threshold.append(threshold)
+
+        self.n_rules = len(rules)
+        self.term_rule = np.array(term_rule, dtype=np.intp)
+        self.term_feature = np.array(term_feature, dtype=np.intp)
+        self.term_op = np.array(term_op, dtype=np.int8)
+        self.term_threshold = np.array(term_threshold, dtype=np.float64)
+        self._build_index()
+
+    def _build_index(self):
+        """Build the unique terms and the thresholds of each column."""
+        # the nan thresholds of OP_SELF terms would never be equal:
+        keys = zip(self.term_feature.tolist(), self.term_op.tolist(),
+                   np.where(self.term_op == OP_SELF, 0.,
+                            self.term_threshold).tolist())
+        terms = {}
+        self.term_unique = np.array(
+            [terms.setdefault(key, len(terms)) for key in keys],
+            dtype=np.intp)
+        first = np.unique(self.term_unique, return_index=True)[1]
+        self.unique_feature = self.term_feature[first]
+        self.unique_op = self.term_op[first]
+        self.unique_threshold = self.term_threshold[first]
+
+        ranked = np.isin(self.unique_op, (OP_LE, OP_GT))
+        self.feature_thresholds = {}
+        self.unique_rank = np.full(len(first), -1, dtype=np.intp)
+        for feature in np.unique(self.unique_feature[ranked]):
+            in_feature = ranked & (self.unique_feature == feature)
+            thresholds = np.unique(self.unique_threshold[in_feature])
+            self.feature_thresholds[feature] = thresholds
+            self.unique_rank[in_feature] = np.searchsorted(
+                thresholds, self.unique_threshold[in_feature])
+
+    def evaluate(self, X, n_rules=None):
+        """Evaluate the rules on each row of X.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+            The numerical input samples, as an array, a ColumnSubset or a
+            sparse matrix (whose columns are evaluated in CSC format,
+            without being densified).
+
+        n_rules : int, optional
+            If given, only the `n_rules` first rules are evaluated.
+
+        Returns
+        -------
+        activations : array of bool, shape (n_samples, n_rules)
+            activations[i, k] is True if the kth rule selects the ith sample.
+        """
+        return self.evaluate_range(X, 0, self._n_rules(n_rules))
+
+    def evaluate_packed(self, X, n_rules=None):
+        """Evaluate the rules on each row of X into packed bits.
+
+        The rules are evaluated by blocks of `PACKED_BLOCK_RULES` rules, each
+        block being packed right away, so that the dense boolean activation
+        matrix is never held in memory.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+            The numerical input samples, as an array, a ColumnSubset or a
+            sparse matrix (whose columns are evaluated in CSC format,
+            without being densified).
+
+        n_rules : int, optional
+            If given, only the `n_rules` first rules are evaluated.
+
+        Returns
+        -------
+        activations : RuleActivations, shape (n_samples, n_rules)
+        """
+        n_rules = self._n_rules(n_rules)
+        n_samples = X.shape[0]
+        last_term = np.searchsorted(self.term_rule, n_rules)
+        terms, mask_index = np.unique(self.term_unique[:last_term],
+                                      return_inverse=True)
+
+        # The masks of the unique terms are shared by all the blocks of
+        # rules, and computed on as many rows as fit in TERM_MASKS_SIZE (the
+        # rows of a sparse matrix being sliced in CSR format):
+        if sparse.issparse(X):
+            X = X.tocsr()
+        bits = np.empty((n_samples, (n_rules + 7) // 8), dtype=np.uint8)
+        n_rows = max(TERM_MASKS_SIZE // max(len(terms), 1), 1)
+        for row_start in range(0, n_samples, n_rows):
+            rows = slice(row_start, row_start + n_rows)
+            masks = self._term_masks(X[rows], terms)
+            for start in range(0, n_rules, PACKED_BLOCK_RULES):
+                stop = min(start + PACKED_BLOCK_RULES, n_rules)
+                bits[rows, start // 8:(stop + 7) // 8] = np.packbits(
+                    self._combine_terms(masks, mask_index, start, stop),
+                    axis=1, bitorder='little')
+        return RuleActivations(bits, n_rules)
+
+    def _n_rules(self, n_rules):
+        return (self.n_rules if n_rules is None
+                else min(max(n_rules, 0), self.n_rules))
+
+    def evaluate_range(self, X, start, stop):
+        """Evaluate the rules `start` to `stop` (excluded) on each row of X.
+
+        Returns
+        -------
+        activations : array of bool, shape (n_samples, stop - start)
+        """
+        # terms are stored rule by rule:
+        first_term, last_term = np.searchsorted(self.term_rule, [start, stop])
+        terms, index = np.unique(self.term_unique[first_term:last_term],
+                                 return_inverse=True)
+        mask_index = np.zeros(last_term, dtype=np.intp)
+        mask_index[first_term:] = index
+        return self._combine_terms(self._term_masks(X, terms), mask_index,
+                                   start, stop)
+
+    def _term_masks(self, X, terms):
+        """Evaluate the unique terms `terms` on each row of X.
+
+        The values of a column are ranked once in its thresholds, its '<='
+        and '>' terms being comparisons of these rank codes. Integer columns
+        (e.g. bin codes) are ranked in integer thresholds, without any float
+        conversion, and float32 columns in thresholds rounded down to
+        float32, with the semantics of float64 comparisons.
+
+        Returns
+        -------
+        masks : array of bool, shape (n_samples, len(terms))
+        """
+        if sparse.issparse(X):
+            X = _as_csc(X)
+        masks = np.empty((X.shape[0], len(terms)), dtype=bool, order='F')
+        ranks = {}
+        for k, term in enumerate(terms):
+            feature = self.unique_feature[term]
+            op = self.unique_op[term]
+            column = _get_column(X, feature)
+            if op == OP_LE or op == OP_GT:
+                if feature not in ranks:
+                    thresholds = self.feature_thresholds[feature]
+                    if column.dtype.kind in 'ui':
+                        thresholds = _integer_thresholds(thresholds,
+                                                         column.dtype)
+                    elif column.dtype == np.float32:
+                        thresholds = _float32_thresholds(thresholds)
+                    rank = _rank(column, thresholds).astype(
+                        np.min_scalar_type(len(thresholds)))
+                    # nan values are ranked last, but are never '>' a value:
+                    not_nan = _compare(column, OP_SELF, np.nan)
+                    ranks[feature] = rank, (None if not_nan.all()
+                                            else not_nan)
+                rank, not_nan = ranks[feature]
+                position = int(self.unique_rank[term])
+                if op == OP_LE:
+                    masks[:, k] = rank <= position
+                else:
+                    masks[:, k] = rank > position
+                    if not_nan is not None:
+                        masks[:, k] &= not_nan
+            else:
+                masks[:, k] = _compare(column, op,
+                                       self.unique_threshold[term])
+        return masks
+
+    def _combine_terms(self, masks, mask_index, start, stop):
+        """AND the term masks of the rules `start` to `stop` (excluded).
+
+        The mask of the term t is the column mask_index[t] of masks.
+        """
+        first_term, last_term = np.searchsorted(self.term_rule, [start, stop])
+        activations = np.ones((masks.shape[0], stop - start), dtype=bool,
+                              order='F')
+        for term in range(first_term, last_term):
+            activations[:, self.term_rule[term] - start] &= \
+                masks[:, mask_index[term]]
+        return activations
+
+
+class ColumnSubset:
+    """ Some columns of a 2-D dataset, read as the columns of an array.
+
+    It holds the columns of a DataFrame or structured array referenced by a
+    set of rules, so that the rules are evaluated without converting the
+    other columns. ``X[:, j]`` returns the column j and ``X[rows]`` a
+    ColumnSubset of a slice of rows, both being views.
+
+    Parameters
+    ----------
+
+    columns : dict
+        The 1-D array of each column index.
+
+    shape : tuple (n_samples, n_features)
+        The shape of the whole dataset.
+    """
+
+    def __init__(self, columns, shape):
+        self.columns = columns
+        self.shape = shape
+
+    @classmethod
+    def from_frame(cls, X, features):
+        """Take the columns `features` of a DataFrame or structured array.
+
+        Parameters
+        ----------
+        X : DataFrame or structured array, shape (n_samples, n_features)
+            The columns are taken by position, in the order of the fields
+            of a structured array.
+
+        features : iterable of int
+            The indices of the columns to take.
+        """
+        if hasattr(X, 'iloc'):
+            n_features = X.shape[1]
+            columns = {j: X.iloc[:, j].to_numpy() for j in features}
+        else:
+            n_features = len(X.dtype.names)
+            columns = {j: X[X.dtype.names[j]] for j in features}
+        return cls(columns, (len(X), n_features))
+
+    def __getitem__(self, key):
+        if isinstance(key, tuple):
+            rows, feature = key
+            return self.columns[feature][rows]
+        columns = {j: column[key] for j, column in self.columns.items()}
+        return ColumnSubset(columns, (len(range(self.shape[0])[key]),
+                                      self.shape[1]))
+
+    def __len__(self):
+        return self.shape[0]
+
+
+def is_frame(X):
+    """Whether X is a DataFrame or a structured array."""
+    return hasattr(X, 'iloc') or (
+        isinstance(X, np.ndarray) and X.dtype.names is not None)
+
+
+class SparseColumn:
+    """ A column of a sparse matrix: its stored values at some rows, the
+    other rows being zeros.
+
+    Parameters
+    ----------
+
+    rows : array, shape (n_stored,)
+        The rows of the stored values.
+
+    values : array, shape (n_stored,)
+        The stored values.
+
+    n_samples : int
+        The number of rows of the column.
+    """
+
+    def __init__(self, rows, values, n_samples):
+        self.rows = rows
+        self.values = values
+        self.n_samples = n_samples
+
+    @property
+    def dtype(self):
+        return self.values.dtype
+
+
+def _as_csc(X):
+    """X as a CSC matrix without duplicate entries."""
+    X = X.tocsc()
+    if not X.has_canonical_format:
+        X = X.copy()
+        X.sum_duplicates()
+    return X
+
+
+def _get_column(X, feature):
+    """The column of X, as a SparseColumn if X is a CSC matrix."""
+    if sparse.issparse(X):
+        start, stop = X.indptr[feature], X.indptr[feature + 1]
+        return SparseColumn(X.indices[start:stop], X.data[start:stop],
+                            X.shape[0])
+    return X[:, feature]
+
+
+def _rank(column, thresholds):
+    """The number of thresholds strictly lower than each value."""
+    if isinstance(column, SparseColumn):
+        rank = np.full(column.n_samples, np.searchsorted(
+            thresholds, np.zeros(1, dtype=column.dtype))[0])
+        rank[column.rows] = np.searchsorted(thresholds, column.values)
+        return rank
+    return np.searchsorted(thresholds, column)
+
+
+def _compare(column, op, threshold):
+    """The mask of the values of the column verifying ``value op threshold``,
+    the implicit zeros of a SparseColumn being compared once."""
+    if isinstance(column, SparseColumn):
+        zero = _compare(np.zeros(1, dtype=column.dtype), op, threshold)[0]
+        mask = np.full(column.n_samples, zero)
+        mask[column.rows] = _compare(column.values, op, threshold)
+        return mask
+    if op == OP_LE:
+        return column <= threshold
+    elif op == OP_GT:
+        return column > threshold
+    elif op == OP_LT:
+        return column < threshold
+    elif op == OP_GE:
+        return column >= threshold
+    elif op == OP_EQ:
+        return column == threshold
+    return column == column
+
+
+def _integer_thresholds(thresholds, dtype):
+    """The thresholds as integers of dtype, when they all fit in it.
+
+    For an integer x, ``x <= t`` if and only if ``x <= floor(t)``, and the
+    ranks of x in the floored thresholds give the same comparisons.
+    """
+    floored = np.floor(thresholds)
+    info = np.iinfo(dtype)
+    if len(floored) > 0 and (floored[0] < info.min or floored[-1] > info.max):
+        return thresholds
+    return floored.astype(dtype)
+
+
+def _float32_thresholds(thresholds):
+    """The largest float32 lower than or equal to each threshold.
+
+    For a float32 x, ``x <= t`` if and only if ``x <= t32``, t32 being the
+    largest float32 lower than or equal to t, the rounded thresholds
+    remaining sorted.
+    """
+    with np.errstate(over='ignore'):
+        rounded = thresholds.astype(np.float32)
+    above = rounded > thresholds
+    rounded[above] = np.nextafter(rounded[above], np.float32(-np.inf))
+    return rounded
+
+
+class RuleActivations:
+    """ The rules activated by each sample, stored as a packed bit matrix.
+
+    Bit k of row i (in little bit order along the rule axis) is set when the
+    kth rule selects the ith sample. It is computed once by
+    ``SkopeRules.rule_activations`` and can be given in place of X to every
+    scoring method of ``SkopeRules``.
+
+    Parameters
+    ----------
+
+    bits : array of uint8, shape (n_samples, ceil(n_rules / 8))
+        The packed activations.
+
+    n_rules : int
+        The number of rules.
+    """
+
+    def __init__(self, bits, n_rules):
+        self.bits = bits
+        self.n_rules = n_rules
+
+    @classmethod
+    def from_dense(cls, activations):
+        """Pack a boolean activation matrix of shape (n_samples, n_rules)."""
+        return cls(np.packbits(activations, axis=1, bitorder='little'),
+                   activations.shape[1])
+
+    @property
+    def shape(self):
+        return self.bits.shape[0], self.n_rules
+
+    def to_dense(self, n_rules=None):
+        """Unpack the activations of the `n_rules` first rules.
+
+        Returns
+        -------
+        activations : array of bool, shape (n_samples, n_rules)
+        """
+        n_rules = self._n_rules(n_rules)
+        return np.unpackbits(self.bits, axis=1, count=n_rules,
+                             bitorder='little').view(bool)
+
+    def count(self):
+        """Number of activated rules of each sample (popcount of the rows).
+
+        Returns
+        -------
+        counts : array, shape (n_samples,)
+        """
+        counts = np.zeros(self.bits.shape[0], dtype=np.intp)
+        for byte in self.bits.T:
+            counts += np.bitwise_count(byte)
+        return counts
+
+    def weighted_sum(self, weights):
+        """Sum of the weights of the activated rules of each sample.
+
+        A table of the summed weights of every byte value is computed for
+        each byte of the rows, so that the sum is read byte by byte from the
+        packed words.
+
+        Parameters
+        ----------
+        weights : array, shape (n_rules,)
+            The weight of each rule.
+
+        Returns
+        -------
+        scores : array, shape (n_samples,)
+        """
+        n_bytes = self.bits.shape[1]
+        padded_weights = np.zeros(8 * n_bytes)
+        padded_weights[:self.n_rules] = weights
+        tables = BYTE_BITS.dot(padded_weights.reshape(n_bytes, 8).T)
+
+        scores = np.zeros(self.bits.shape[0])
+        for table, byte in zip(tables.T, self.bits.T):
+            scores += table[byte]
+        return scores
+
+    def first_active(self):
+        """Index of the first activated rule of each sample.
+
+        Returns
+        -------
+        first_rule : array, shape (n_samples,)
+            The index of the first set bit of each row, -1 if no rule is
+            activated.
+        """
+        n_samples = self.bits.shape[0]
+        if self.bits.shape[1] == 0:
+            return np.full(n_samples, -1, dtype=np.intp)
+        first_byte = (self.bits != 0).argmax(axis=1)
+        value = self.bits[np.arange(n_samples), first_byte]
+        return np.where(value != 0, 8 * first_byte + BYTE_LOWEST_BIT[value],
+                        -1)
+
+    def any(self, n_rules=None):
+        """Whether one of the `n_rules` first rules is activated.
+
+        Returns
+        -------
+        detected : array of bool, shape (n_samples,)
+        """
+        n_full_bytes, n_bits = divmod(self._n_rules(n_rules), 8)
+        detected = (self.bits[:, :n_full_bytes] != 0).any(axis=1)
+        if n_bits > 0:
+            detected |= (self.bits[:, n_full_bytes] & ((1 << n_bits) - 1)) != 0
+        return detected
+
+    def _n_rules(self, n_rules):
+        return (self.n_rules if n_rules is None
+                else min(max(n_rules, 0), self.n_rules))
@@ -1,26 +1,49 @@
 import numpy as np
-from collections import Counter
 try:
     from collections.abc import Iterable  # Python 3.10+
 except ImportError:
     from collections import Iterable  # Python <3.9
-import pandas
 import numbers
 from warnings import warn
 
+from scipy import sparse
+
+from joblib import effective_n_jobs
 from sklearn.base import BaseEstimator
 from sklearn.utils.validation import check_X_y, check_array, check_is_fitted
+from sklearn.utils.validation import check_consistent_length, column_or_1d
 from sklearn.utils.multiclass import check_classification_targets
+from sklearn.utils import check_random_state
 # from sklearn.utils import indices_to_mask
 from sklearn.utils._mask import indices_to_mask
 from sklearn.tree import DecisionTreeClassifier, DecisionTreeRegressor
 from sklearn.ensemble import BaggingClassifier, BaggingRegressor
 from sklearn.tree import _tree
+from sklearn.utils.parallel import Parallel, delayed
 
-from .rule import Rule, replace_feature_name
+from .binning import QuantileBinner
+from .rule import Rule, RuleRenderer
+from .scoring import CompiledRules, RuleActivations, ColumnSubset, is_frame
 
 INTEGER_TYPES = (numbers.Integral, int)
 BASE_FEATURE_NAME = "__C__"
+DEFAULT_CHUNK_SIZE = 65536
+UNIQUE_RULES_BLOCK_SIZE = 256
+UNIQUE_RULES_BLOCK_CELLS = 2 ** 21
+MIN_PARALLEL_BLOCK_SIZE = 16384
+SCORING_METHODS = ('predict', 'decision_function', 'rules_vote',
+                   'score_top_rules')
+
+# Number of samples the coverage of the rules is compared on, and number of
+# hash functions of their MinHash signatures:
+COVERAGE_SAMPLE_SIZE = 10000
+MINHASH_SIZE = 128
+
+# Directions of the terms of a feature in a rule, used to split rules when
+# deduplicating them, the first one taking precedence:
+DIRECTION_UPPER = 1  # '<='
+DIRECTION_LOWER = 2  # '>' or '>='
+DIRECTION_OTHER = 3
 
 
 class SkopeRules(BaseEstimator):
@@ -71,10 +94,41 @@ class SkopeRules(BaseEstimator):
         for each tree depth. It allows you to create and compare
         rules of different length.
 
+    share_depths : boolean, optional (default=False)
+        If True and max_depth is an iterable, only n_estimators trees are
+        grown, at the largest depth, and the rules of every depth of
+        max_depth are read from these trees truncated at that depth,
+        instead of growing n_estimators trees per depth. When all the
+        features are considered at each split (max_features=None or 1.),
+        trees grown on the same sample share their top levels, so the rules
+        are the same up to ties between splits. When the features are
+        subsampled, the features drawn for the deeper splits shift the random
+        stream of the splits grown after them, so that the trees and their
+        rules differ from those grown at each depth.
+
     max_depth_duplication : integer, optional (default=None)
         The maximum depth of the decision tree for rule deduplication,
         if None then no deduplication occurs.
 
+    coverage_similarity : float or None, optional (default=None)
+        If not None, rules selecting nearly the same samples are clustered,
+        and only the rule with the best F1 score of each cluster is kept.
+        Two rules are similar when the Jaccard similarity of the samples
+        they select, on a sample of the training data of at most 10000
+        rows, is estimated to be at least `coverage_similarity` (in
+        (0, 1]) from MinHash signatures. Candidate pairs are found by
+        locality sensitive hashing of bands of the signatures, so that the
+        cost is subquadratic in the number of rules. It is applied after
+        the deduplication of `max_depth_duplication`.
+
+    skip_redundant_regressor : boolean, optional (default=False)
+        Whether to skip the regression trees when `sample_weight` is not
+        given to `fit`. The regression target is then the binary target of
+        the classification trees, which regression trees split exactly as
+        classification trees do: they only produce the same rules again,
+        doubling the fit time and the number of occurrences ``nb`` of each
+        rule.
+
     max_features : int, float, string or None, optional (default="auto")
         The number of features considered (by each decision tree) when looking
         for the best split:
@@ -100,9 +154,29 @@ class SkopeRules(BaseEstimator):
               `ceil(min_samples_split * n_samples)` are the minimum
               number of samples for each split.
 
+    n_bins : int or None, optional (default=None)
+        If not None, each feature is binned into at most `n_bins` bins at
+        its quantiles, and stored as uint8 codes (uint16 above 256 bins).
+        The trees are grown on the codes, so that the thresholds of the
+        rules are bin edges, and the rules are evaluated as integer
+        comparisons of the codes of the samples in ``predict`` and the
+        other scoring methods. It divides the memory used by X by 4 to 8,
+        at the cost of coarser thresholds. The bins of a feature with at
+        most `n_bins` distinct values lose nothing. Not supported with
+        sparse input, in ``fit`` as in the scoring methods.
+
+    dtype : numpy dtype or None, optional (default=None)
+        The type X is converted to in ``fit`` and the scoring methods, e.g.
+        ``np.float32`` to halve the memory used by float64 data. If None,
+        numerical data is used with its own type. The trees compare float32
+        values, and float32 data is scored with the same float32 semantics,
+        without being converted to float64.
+
     n_jobs : integer, optional (default=1)
         The number of jobs to run in parallel for both `fit` and `predict`.
         If -1, then the number of jobs is set to the number of cores.
+        At prediction time, the rules are evaluated on blocks of rows by a
+        pool of threads.
 
     random_state : int, RandomState instance or None, optional
         - If int, random_state is the seed used by the random number generator.
@@ -113,6 +187,43 @@ class SkopeRules(BaseEstimator):
     verbose : int, optional (default=0)
         Controls the verbosity of the tree building process.
 
+    rule_evaluation : {'tree', 'unique'}, optional (default='tree')
+        How the rules are evaluated on the OOB samples of the trees they
+        come from.
+            - If 'tree', the OOB samples of each tree are pushed through
+              it, giving the OOB counts of all its rules at once. As the
+              trees compare the values cast to float32, this is only done
+              when X is of float32 type or of a small integer type (such as
+              the bin codes); otherwise the rules of each tree are evaluated
+              on its OOB samples with the comparisons used for scoring.
+            - If 'unique', the rules of all the trees are first collected
+              and factorized, then each unique rule is evaluated once on
+              the training data and its OOB counts in every tree it comes
+              from are computed in a batched vectorized pass, by blocks of
+              rules whose size decreases with the number of samples to
+              bound the memory used. It is faster when many trees produce
+              the same rules. The rules being compared to the values as in
+              'tree', it selects the same rules.
+
+    aggregation : {'mean', 'counts'}, optional (default='mean')
+        How the OOB performances of the occurrences of a rule in several
+        trees are merged.
+            - If 'mean', the precision and recall of each occurrence
+              verifying precision_min and recall_min are averaged.
+            - If 'counts', the OOB true positives, support and positives of
+              all the occurrences are summed, and the precision and recall
+              of the rule are computed once from these pooled counts before
+              applying precision_min and recall_min.
+
+    warm_start : bool, optional (default=False)
+        When set to True, reuse the trees of the previous call to fit and
+        add more trees if n_estimators was increased. Only the rules of the
+        new trees are evaluated (on the OOB samples of the data given to
+        this call to fit), and merged into the running means of the
+        precision and recall of the previously found rules, or into their
+        pooled counts, `aggregation` being kept. Otherwise, fit a whole new
+        set of trees.
+
     Attributes
     ----------
     rules_ : dict of tuples (rule, precision, recall, nb).
@@ -140,6 +251,17 @@ class SkopeRules(BaseEstimator):
 
     classes_ : array, shape (n_classes,)
         The classes labels.
+
+    estimators_types_ : list of str
+        The type of each estimator of `estimators_`, either 'classifier' or
+        'regressor'.
+
+    compiled_rules_ : CompiledRules
+        The selected rules compiled into term arrays, used by the scoring
+        methods to evaluate all rules as vectorized masks.
+
+    binner_ : QuantileBinner or None
+        The bins of the features when `n_bins` is set, None otherwise.
     """
 
     def __init__(self,
@@ -152,12 +274,20 @@ class SkopeRules(BaseEstimator):
                  bootstrap=False,
                  bootstrap_features=False,
                  max_depth=3,
+                 share_depths=False,
                  max_depth_duplication=None,
+                 coverage_similarity=None,
+                 skip_redundant_regressor=False,
                  max_features=1.,
                  min_samples_split=2,
+                 n_bins=None,
+                 dtype=None,
                  n_jobs=1,
                  random_state=None,
-                 verbose=0):
+                 verbose=0,
+                 rule_evaluation='tree',
+                 aggregation='mean',
+                 warm_start=False):
         self.precision_min = precision_min
         self.recall_min = recall_min
         self.feature_names = feature_names
@@ -167,21 +297,30 @@ class SkopeRules(BaseEstimator):
         self.bootstrap = bootstrap
         self.bootstrap_features = bootstrap_features
         self.max_depth = max_depth
+        self.share_depths = share_depths
         self.max_depth_duplication = max_depth_duplication
+        self.coverage_similarity = coverage_similarity
+        self.skip_redundant_regressor = skip_redundant_regressor
         self.max_features = max_features
         self.min_samples_split = min_samples_split
+        self.n_bins = n_bins
+        self.dtype = dtype
         self.n_jobs = n_jobs
         self.random_state = random_state
         self.verbose = verbose
+        self.rule_evaluation = rule_evaluation
+        self.aggregation = aggregation
+        self.warm_start = warm_start
 
     def fit(self, X, y, sample_weight=None):
         """Fit the model according to the given training data.
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
+        X : array-like or sparse matrix, shape (n_samples, n_features)
             Training vector, where n_samples is the number of samples and
-            n_features is the number of features.
+            n_features is the number of features. CSR and CSC matrices are
+            used as such by the trees and the rules.
 
         y : array-like, shape (n_samples,)
             Target vector relative to X. Has to follow the convention 0 for
@@ -199,7 +338,8 @@ class SkopeRules(BaseEstimator):
             Returns self.
         """
 
-        X, y = check_X_y(X, y)
+        X, y = check_X_y(X, y, accept_sparse=['csr', 'csc'],
+                         dtype=self._input_dtype())
         check_classification_targets(y)
         self.n_features_ = X.shape[1]
 
@@ -215,6 +355,24 @@ class SkopeRules(BaseEstimator):
                 and self.max_depth_duplication is not None:
             raise ValueError("max_depth_duplication should be an integer"
                              )
+        if self.coverage_similarity is not None and \
+                not 0. < self.coverage_similarity <= 1.:
+            raise ValueError("coverage_similarity should be in (0, 1], got %r"
+                             % self.coverage_similarity)
+        if self.rule_evaluation not in ('tree', 'unique'):
+            raise ValueError("rule_evaluation should be 'tree' or 'unique',"
+                             " got %r" % self.rule_evaluation)
+        if self.aggregation not in ('mean', 'counts'):
+            raise ValueError("aggregation should be 'mean' or 'counts', got %r"
+                             % self.aggregation)
+        if self.warm_start and hasattr(self, '_baggings') \
+                and self.aggregation != self._tallies_aggregation:
+            raise ValueError("aggregation cannot be changed when warm"
+                             " starting: the rules of the previous trees were"
+                             " aggregated with %r, got %r"
+                             % (self._tallies_aggregation, self.aggregation))
+        if self.n_bins is not None and sparse.issparse(X):
+            raise ValueError("n_bins is not supported with sparse input.")
         if not set(self.classes_) == set([0, 1]):
             warn("Found labels %s. This method assumes target class to be"
                  " labeled as 1 and normal data to be labeled as 0. Any label"
@@ -248,11 +406,6 @@ class SkopeRules(BaseEstimator):
 
         self.max_samples_ = max_samples
 
-        self.rules_ = {}
-        self.estimators_ = []
-        self.estimators_samples_ = []
-        self.estimators_features_ = []
-
         # default columns names :
         feature_names_ = [BASE_FEATURE_NAME + x for x in
                           np.arange(X.shape[1]).astype(str)]
@@ -263,50 +416,30 @@ class SkopeRules(BaseEstimator):
             self.feature_dict_ = {BASE_FEATURE_NAME + str(i): feat
                                   for i, feat in enumerate(feature_names_)}
         self.feature_names_ = feature_names_
-
-        clfs = []
-        regs = []
+        self._rule_renderer = RuleRenderer(
+            feature_names_, [self.feature_dict_[name]
+                             for name in feature_names_])
 
         self._max_depths = self.max_depth \
             if isinstance(self.max_depth, Iterable) else [self.max_depth]
 
-        for max_depth in self._max_depths:
-            bagging_clf = BaggingClassifier(
-                estimator=DecisionTreeClassifier(
-                    max_depth=max_depth,
-                    max_features=self.max_features,
-                    min_samples_split=self.min_samples_split),
-                n_estimators=self.n_estimators,
-                max_samples=self.max_samples_,
-                max_features=self.max_samples_features,
-                bootstrap=self.bootstrap,
-                bootstrap_features=self.bootstrap_features,
-                # oob_score=... XXX may be added
-                # if selection on tree perf needed.
-                # warm_start=... XXX may be added to increase computation perf.
-                n_jobs=self.n_jobs,
-                random_state=self.random_state,
-                verbose=self.verbose)
-
-            bagging_reg = BaggingRegressor(
-                estimator=DecisionTreeRegressor(
-                    max_depth=max_depth,
-                    max_features=self.max_features,
-                    min_samples_split=self.min_samples_split),
-                n_estimators=self.n_estimators,
-                max_samples=self.max_samples_,
-                max_features=self.max_samples_features,
-                bootstrap=self.bootstrap,
-                bootstrap_features=self.bootstrap_features,
-                # oob_score=... XXX may be added
-                # if selection on tree perf needed.
-                # warm_start=... XXX may be added to increase computation perf.
-                n_jobs=self.n_jobs,
-                random_state=self.random_state,
-                verbose=self.verbose)
-
-            clfs.append(bagging_clf)
-            regs.append(bagging_reg)
+        # depths of the grown trees, and depths the rules are read at:
+        trees_depths = self._max_depths
+        rules_depths = None
+        if self.share_depths and len(self._max_depths) > 1:
+            trees_depths = [None if None in self._max_depths
+                            else max(self._max_depths)]
+            rules_depths = list(self._max_depths)
+
+        # Grow the trees and evaluate the rules on the bin codes, keeping the
+        # bins of the previous trees when warm starting:
+        if self.n_bins is None:
+            self.binner_ = None
+        elif not (self.warm_start and hasattr(self, '_baggings')
+                  and getattr(self, 'binner_', None) is not None):
+            self.binner_ = QuantileBinner(self.n_bins).fit(X)
+        if self.binner_ is not None:
+            X = self.binner_.transform(X)
 
         # define regression target:
         if sample_weight is not None:
@@ -321,83 +454,443 @@ class SkopeRules(BaseEstimator):
         else:
             y_reg = y  # same as an other classification bagging
 
-        for clf in clfs:
-            clf.fit(X, y)
-            self.estimators_ += clf.estimators_
-            self.estimators_samples_ += clf.estimators_samples_
-            self.estimators_features_ += clf.estimators_features_
-
-        for reg in regs:
-            reg.fit(X, y_reg)
-            self.estimators_ += reg.estimators_
-            self.estimators_samples_ += reg.estimators_samples_
-            self.estimators_features_ += reg.estimators_features_
-
-        rules_ = []
-        for estimator, samples, features in zip(self.estimators_,
-                                                self.estimators_samples_,
-                                                self.estimators_features_):
-
-            # Create mask for OOB samples
-            mask = ~indices_to_mask(samples, n_samples)            
-                        
-            if sum(mask) == 0:
-                warn("OOB evaluation not possible: doing it in-bag."
-                     " Performance evaluation is likely to be wrong"
-                     " (overfitting) and selected rules are likely to"
-                     " not perform well! Please use max_samples < 1.")
-                mask = samples
-            rules_from_tree = self._tree_to_rules(
-                estimator, np.array(self.feature_names_)[features])
-
-            # XXX todo: idem without dataframe
-            X_oob = pandas.DataFrame((X[mask, :])[:, features],
-                                     columns=np.array(
-                                         self.feature_names_)[features])
-
-            if X_oob.shape[1] > 1:  # otherwise pandas bug (cf. issue #16363)
-                y_oob = y[mask]
-                y_oob = np.array((y_oob != 0))
-
-                # Add OOB performances to rules:
-                rules_from_tree = [(r, self._eval_rule_perf(r, X_oob, y_oob))
-                                   for r in set(rules_from_tree)]
-                rules_ += rules_from_tree
-
-        # Factorize rules before semantic tree filtering
-        rules_ = [
-            tuple(rule)
-            for rule in
-            [Rule(r, args=args) for r, args in rules_]]
-
-        # keep only rules verifying precision_min and recall_min:
-        for rule, score in rules_:
-            if score[0] >= self.precision_min and score[1] >= self.recall_min:
-                if rule in self.rules_:
-                    # update the score to the new mean
-                    c = self.rules_[rule][2] + 1
-                    b = self.rules_[rule][1] + 1. / c * (
-                        score[1] - self.rules_[rule][1])
-                    a = self.rules_[rule][0] + 1. / c * (
-                        score[0] - self.rules_[rule][0])
-
-                    self.rules_[rule] = (a, b, c)
-                else:
-                    self.rules_[rule] = (score[0], score[1], 1)
+        if not self.warm_start or not hasattr(self, '_baggings'):
+            # Precision, recall and number of occurrences of each rule, or
+            # its OOB counts when aggregating counts:
+            self._rule_tallies = {}
+            # OOB counts of the occurrences averaged when aggregating means:
+            self._mean_counts = {}
+            self._tallies_aggregation = self.aggregation
+
+            clfs = []
+            regs = []
+
+            for max_depth in trees_depths:
+                bagging_clf = BaggingClassifier(
+                    estimator=DecisionTreeClassifier(
+                        max_depth=max_depth,
+                        max_features=self.max_features,
+                        min_samples_split=self.min_samples_split),
+                    n_estimators=self.n_estimators,
+                    max_samples=self.max_samples_,
+                    max_features=self.max_samples_features,
+                    bootstrap=self.bootstrap,
+                    bootstrap_features=self.bootstrap_features,
+                    # oob_score=... XXX may be added
+                    # if selection on tree perf needed.
+                    warm_start=self.warm_start,
+                    n_jobs=self.n_jobs,
+                    random_state=self.random_state,
+                    verbose=self.verbose)
+
+                bagging_reg = BaggingRegressor(
+                    estimator=DecisionTreeRegressor(
+                        max_depth=max_depth,
+                        max_features=self.max_features,
+                        min_samples_split=self.min_samples_split),
+                    n_estimators=self.n_estimators,
+                    max_samples=self.max_samples_,
+                    max_features=self.max_samples_features,
+                    bootstrap=self.bootstrap,
+                    bootstrap_features=self.bootstrap_features,
+                    # oob_score=... XXX may be added
+                    # if selection on tree perf needed.
+                    warm_start=self.warm_start,
+                    n_jobs=self.n_jobs,
+                    random_state=self.random_state,
+                    verbose=self.verbose)
+
+                clfs.append(bagging_clf)
+                regs.append(bagging_reg)
+
+            if sample_weight is None and self.skip_redundant_regressor:
+                regs = []
+
+            self._baggings = clfs + regs
+            self._baggings_samples = [[] for _ in self._baggings]
+
+        # Fit the baggings, which only add the missing trees when warm
+        # starting, and collect the trees whose rules are to be evaluated:
+        self.estimators_ = []
+        self.estimators_samples_ = []
+        self.estimators_features_ = []
+        self.estimators_types_ = []
+        new_estimators = []
+        for i, bagging in enumerate(self._baggings):
+            n_fitted = len(getattr(bagging, 'estimators_', []))
+            # the baggings of a fit without warm start are warm started too,
+            # their trees being those the tallies come from:
+            bagging.set_params(n_estimators=self.n_estimators,
+                               max_samples=self.max_samples_,
+                               warm_start=self.warm_start)
+            if isinstance(bagging, BaggingClassifier):
+                bagging.fit(X, y)
+                estimator_type = 'classifier'
+            else:
+                bagging.fit(X, y_reg)
+                estimator_type = 'regressor'
+
+            # When warm starting, the bagging may only draw again the
+            # samples of its new trees:
+            samples = bagging.estimators_samples_
+            if len(bagging.estimators_) == n_fitted:
+                # no new tree, the samples being those of the last ones:
+                samples = self._baggings_samples[i]
+            elif len(samples) < len(bagging.estimators_):
+                samples = self._baggings_samples[i][:n_fitted] + samples
+            self._baggings_samples[i] = samples
+
+            new_estimators += list(range(
+                len(self.estimators_) + n_fitted,
+                len(self.estimators_) + len(bagging.estimators_)))
+            self.estimators_ += bagging.estimators_
+            self.estimators_samples_ += samples
+            self.estimators_features_ += bagging.estimators_features_
+            self.estimators_types_ += ([estimator_type] *
+                                       len(bagging.estimators_))
+
+        if any(np.unique(self.estimators_samples_[i]).shape[0] == n_samples
+               for i in new_estimators):
+            warn("OOB evaluation not possible: doing it in-bag."
+                 " Performance evaluation is likely to be wrong"
+                 " (overfitting) and selected rules are likely to"
+                 " not perform well! Please use max_samples < 1.")
+
+        if self.rule_evaluation == 'unique':
+            all_rules = [self._eval_unique_rules(new_estimators, X, y,
+                                                 rules_depths)]
+            if self.aggregation == 'counts':
+                all_rules = [_sum_rules_counts(all_rules[0])]
+        else:
+            # Extract and evaluate the rules of batches of estimators in
+            # parallel, X being memory-mapped by joblib rather than copied
+            # (the OOB rows of a sparse matrix being taken in CSR format):
+            if sparse.issparse(X):
+                X = X.tocsr()
+            n_jobs = max(min(effective_n_jobs(self.n_jobs),
+                             len(new_estimators)), 1)
+            batches = np.array_split(new_estimators, n_jobs)
+            all_rules = Parallel(n_jobs=n_jobs, verbose=self.verbose)(
+                delayed(_parallel_eval_rules)(
+                    [self.estimators_[i] for i in batch],
+                    [self.estimators_samples_[i] for i in batch],
+                    [self.estimators_features_[i] for i in batch],
+                    X, y, rules_depths, self.aggregation == 'counts')
+                for batch in batches)
+
+        tallies = self._rule_tallies
+        if self.aggregation == 'counts':
+            # merge the OOB counts of the rules found by each job:
+            for rules_counts in all_rules:
+                for rule, counts in rules_counts.items():
+                    if rule in tallies:
+                        tallies[rule] = tallies[rule] + counts
+                    else:
+                        tallies[rule] = counts
+
+            # keep only rules verifying precision_min and recall_min:
+            self.rules_ = []
+            for rule, (n_true_pos, n_detected, n_pos, nb) in tallies.items():
+                score = self._eval_rule_perf(n_detected, n_true_pos, n_pos)
+                if score[0] >= self.precision_min and \
+                        score[1] >= self.recall_min:
+                    self.rules_.append((rule, (score[0], score[1], int(nb))))
+        else:
+            self._update_mean_tallies(
+                [rule for rules in all_rules for rule in rules])
+            self.rules_ = list(tallies.items())
 
-        self.rules_ = sorted(self.rules_.items(),
+        self.rules_ = sorted(self.rules_,
                              key=lambda x: (x[1][0], x[1][1]), reverse=True)
 
         # Deduplicate the rule using semantic tree
         if self.max_depth_duplication is not None:
-            self.rules_ = self.deduplicate(self.rules_)
+            factorized_rules = {rule.to_string(self.feature_names_): rule
+                                for rule, _ in self.rules_}
+            self.rules_ = [(factorized_rules[rule], perf)
+                           for rule, perf in self.deduplicate(
+                               [(rule.to_string(self.feature_names_), perf)
+                                for rule, perf in self.rules_])]
+
+        # Deduplicate the rules selecting nearly the same samples
+        if self.coverage_similarity is not None:
+            self.rules_ = [max(cluster, key=self.f1_score) for cluster in
+                           self._find_similar_coverages(self.rules_, X)]
 
         self.rules_ = sorted(self.rules_, key=lambda x: - self.f1_score(x))
-        self.rules_without_feature_names_ = self.rules_
 
-        # Replace generic feature names by real feature names
-        self.rules_ = [(replace_feature_name(rule, self.feature_dict_), perf)
-                       for rule, perf in self.rules_]
+        # Selected rules whose statistics are updated by partial_fit, with
+        # their true positives, support and positives counts:
+        self._candidate_rules = self.rules_
+        counts = tallies if self.aggregation == 'counts' \
+            else self._mean_counts
+        self._candidate_counts = np.zeros((len(self.rules_), 3),
+                                          dtype=np.int64)
+        for k, (rule, _) in enumerate(self.rules_):
+            self._candidate_counts[k] = counts[rule][:3]
+
+        self._set_rules(self.rules_)
+
+        return self
+
+    def _eval_unique_rules(self, estimators, X, y, max_depths=None):
+        """Evaluate each unique rule of the estimators once.
+
+        The rules of all the estimators are first extracted and factorized.
+        Each unique rule is then evaluated once on X, and its OOB counts in
+        every estimator it occurs in are read from a product of its
+        activations with the OOB masks of the estimators.
+
+        Parameters
+        ----------
+        estimators : list of int
+            The indices of the estimators in `estimators_`.
+
+        X : array, shape (n_samples, n_features)
+        y : array, shape (n_samples,)
+        max_depths : list of int or None, optional
+            The depths the rules are read at, see ``_tree_to_rules``.
+
+        Returns
+        -------
+        rules : list of tuples (Rule, (n_true_pos, n_detected, n_pos))
+            Each occurrence of a rule, in the order of the estimators.
+        """
+        n_samples = X.shape[0]
+        y = np.array(y != 0)
+
+        unique_rules = {}
+        occurrences = []
+        # OOB masks, or in-bag sample counts when there is no OOB sample,
+        # whose products are exact in float32 below 2 ** 24 samples:
+        dtype = np.float32 if n_samples < 2 ** 24 else np.float64
+        oob_weights = np.zeros((len(estimators), n_samples), dtype=dtype)
+        for e, i in enumerate(estimators):
+            samples = self.estimators_samples_[i]
+            mask = ~indices_to_mask(samples, n_samples)
+            if mask.any():
+                oob_weights[e] = mask
+            else:
+                oob_weights[e] = np.bincount(samples, minlength=n_samples)
+            for terms, _ in self._tree_to_rules(
+                    self.estimators_[i], self.estimators_features_[i],
+                    max_depths):
+                rule = unique_rules.setdefault(Rule(terms), len(unique_rules))
+                occurrences.append((e, rule))
+
+        if sparse.issparse(X):
+            X = X.tocsc()
+        compiled_rules = CompiledRules(list(unique_rules))
+        n_rules = compiled_rules.n_rules
+        oob_pos_weights = oob_weights[:, y]
+        n_pos = oob_pos_weights.sum(axis=1, dtype=np.float64)
+        n_detected = np.empty((len(estimators), n_rules))
+        n_true_pos = np.empty((len(estimators), n_rules))
+        # blocks of at most UNIQUE_RULES_BLOCK_CELLS activations, whatever
+        # the number of samples:
+        block_size = min(max(UNIQUE_RULES_BLOCK_CELLS // n_samples, 1),
+                         UNIQUE_RULES_BLOCK_SIZE)
+        for start in range(0, n_rules, block_size):
+            stop = min(start + block_size, n_rules)
+            activations = compiled_rules.evaluate_range(
+                X, start, stop).astype(dtype)
+            n_detected[:, start:stop] = oob_weights.dot(activations)
+            n_true_pos[:, start:stop] = oob_pos_weights.dot(activations[y])
+
+        rules = list(unique_rules)
+        return [(rules[k], (int(n_true_pos[e, k]), int(n_detected[e, k]),
+                            int(n_pos[e])))
+                for e, k in occurrences]
+
+    def _update_mean_tallies(self, rules):
+        """Add occurrences of rules to the running means of their scores.
+
+        The OOB counts of the occurrences kept in the means are summed as
+        well, for ``partial_fit`` to start from them.
+
+        Parameters
+        ----------
+        rules : list of tuples (Rule, (n_true_pos, n_detected, n_pos))
+            The rules found by the trees, with their OOB counts.
+        """
+        tallies = self._rule_tallies
+        mean_counts = self._mean_counts
+        for rule, (n_true_pos, n_detected, n_pos) in rules:
+            score = self._eval_rule_perf(n_detected, n_true_pos, n_pos)
+            # keep only rules verifying precision_min and recall_min:
+            if score[0] >= self.precision_min and score[1] >= self.recall_min:
+                counts = np.array([n_true_pos, n_detected, n_pos],
+                                  dtype=np.int64)
+                mean_counts[rule] = mean_counts[rule] + counts \
+                    if rule in mean_counts else counts
+                if rule in tallies:
+                    # update the score to the new mean
+                    c = tallies[rule][2] + 1
+                    b = tallies[rule][1] + 1. / c * (
+                        score[1] - tallies[rule][1])
+                    a = tallies[rule][0] + 1. / c * (
+                        score[0] - tallies[rule][0])
+
+                    tallies[rule] = (a, b, c)
+                else:
+                    tallies[rule] = (score[0], score[1], 1)
+
+    def partial_fit(self, X, y):
+        """Update the precision and recall of the rules on a new batch.
+
+        The rules selected by ``fit`` are evaluated on the labelled batch, and
+        their true positives, support and positives are added to counters
+        starting from the pooled OOB counts of the rules found by ``fit``
+        (those of the occurrences averaged when `aggregation` is 'mean').
+        The precision and recall of each rule are then computed from these
+        counters, and the rules are selected again with `precision_min` and
+        `recall_min` and ranked as in ``fit``. No tree is grown and no new
+        rule is found.
+
+        Parameters
+        ----------
+        X : array-like or sparse matrix, shape (n_samples, n_features)
+            The new samples.
+
+        y : array-like, shape (n_samples,)
+            Target vector relative to X, 0 for normal data and any other
+            label for the target class.
+
+        Returns
+        -------
+        self : object
+            Returns self.
+        """
+        check_is_fitted(self, ['rules_', '_candidate_rules'])
+        X, y = check_X_y(X, y, accept_sparse=['csr', 'csc'],
+                         dtype=self._input_dtype())
+        X = self._validate_X_predict(X)
+        y = np.array(y != 0)
+
+        candidates = CompiledRules([rule for rule, _ in
+                                    self._candidate_rules])
+        activations = candidates.evaluate(X)
+        self._candidate_counts[:, 0] += activations[y].sum(axis=0)
+        self._candidate_counts[:, 1] += activations.sum(axis=0)
+        self._candidate_counts[:, 2] += y.sum()
+
+        rules = []
+        for (rule, perf), (n_true_pos, n_detected, n_pos) in zip(
+                self._candidate_rules, self._candidate_counts):
+            precision, recall = self._eval_rule_perf(n_detected, n_true_pos,
+                                                     n_pos)
+            if precision >= self.precision_min and recall >= self.recall_min:
+                rules.append((rule, (precision, recall, perf[2])))
+
+        rules = sorted(rules, key=lambda x: (x[1][0], x[1][1]), reverse=True)
+        self._set_rules(sorted(rules, key=lambda x: - self.f1_score(x)))
+
+        return self
+
+    def _set_rules(self, rules):
+        """Expose the selected rules and compile them for scoring.
+
+        Parameters
+        ----------
+        rules : list of tuples (Rule, (precision, recall, nb))
+            The selected rules, in their final order.
+        """
+        binner = getattr(self, 'binner_', None)
+        rendered = [self._rule_renderer(
+            rule if binner is None else binner.inverse_transform_rule(rule))
+            for rule, _ in rules]
+        self.rules_without_feature_names_ = [
+            (rule, perf) for (rule, _), (_, perf) in zip(rendered, rules)]
+
+        # Render the rules with the real feature names
+        self.rules_ = [(rule, perf)
+                       for (_, rule), (_, perf) in zip(rendered, rules)]
+
+        self.compiled_rules_ = CompiledRules([rule for rule, _ in rules])
+        self._selected_rules = rules
+
+    def prune(self, X, y, max_rules=None, max_terms=None):
+        """Keep the subset of the rules best ranking a validation set.
+
+        The rules are selected greedily: at each step, the rule whose
+        addition most increases the ROC AUC of ``decision_function`` on
+        (X, y) is added, as long as it increases it and the budgets allow
+        it. The gains in AUC of all the candidates are computed at once
+        from the samples they activate at each distinct score, without
+        ranking the samples again. The selected rules keep their order, and
+        only them are compiled and evaluated by the scoring methods (and
+        updated by ``partial_fit``).
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+            The validation samples.
+
+        y : array-like, shape (n_samples,)
+            Target vector relative to X, 0 for normal data and any other
+            label for the target class. Both classes must be present.
+
+        max_rules : int, optional
+            The maximal number of selected rules. If None, no limit.
+
+        max_terms : int, optional
+            The maximal total number of terms of the selected rules, bounding
+            the number of comparisons made per sample. If None, no limit.
+
+        Returns
+        -------
+        self : object
+            Returns self.
+        """
+        activations = self.rule_activations(X).to_dense()
+        y = column_or_1d(y)
+        check_consistent_length(activations, y)
+        y = np.array(y != 0)
+        if y.all() or not y.any():
+            raise ValueError("prune needs samples of both classes in y.")
+
+        weights = np.array([perf[0] for _, perf in self._selected_rules],
+                           dtype=float)
+        n_terms = np.array([len(rule.terms)
+                            for rule, _ in self._selected_rules])
+        max_rules = len(weights) if max_rules is None else max_rules
+        max_terms = n_terms.sum() if max_terms is None else max_terms
+
+        # The AUC is twice the number of (positive, negative) pairs ranked
+        # right plus the number of tied pairs, over twice the number of
+        # pairs. Adding a rule only changes the pairs of which it activates
+        # one sample, so that the gains of all the candidates are computed
+        # from the counts of the samples they activate at each score.
+        pos_activations = sparse.csc_matrix(activations[y], dtype=np.int64)
+        neg_activations = sparse.csc_matrix(activations[~y], dtype=np.int64)
+        selected = []
+        scores = np.zeros(len(y))
+        while len(selected) < max_rules:
+            budget = max_terms - n_terms[selected].sum()
+            candidates = [k for k in range(len(weights))
+                          if k not in selected and n_terms[k] <= budget]
+            if len(candidates) == 0:
+                break
+            levels, level = np.unique(scores, return_inverse=True)
+            gains = _ranked_pairs_gains(
+                levels, level[y], level[~y], weights[candidates],
+                pos_activations[:, candidates],
+                neg_activations[:, candidates])
+            best = int(np.argmax(gains))
+            if gains[best] <= 0:
+                break
+            k = candidates[best]
+            selected.append(k)
+            scores += weights[k] * activations[:, k]
+
+        rules = [self._selected_rules[k] for k in sorted(selected)]
+        kept = set(rule for rule, _ in rules)
+        is_kept = np.array([rule in kept for rule, _ in self._candidate_rules],
+                           dtype=bool)
+        self._candidate_rules = [candidate for candidate, keep in zip(
+            self._candidate_rules, is_kept) if keep]
+        self._candidate_counts = self._candidate_counts[is_kept]
+        self._set_rules(rules)
 
         return self
 
@@ -406,9 +899,9 @@ class SkopeRules(BaseEstimator):
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            The input samples. Internally, it will be converted to
-            ``dtype=np.float32``
+        X : array-like, shape (n_samples, n_features) or RuleActivations
+            The input samples, or their rule activations as returned by
+            ``rule_activations``.
 
         Returns
         -------
@@ -428,8 +921,11 @@ class SkopeRules(BaseEstimator):
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            The training input samples.
+        X : array-like, shape (n_samples, n_features) or RuleActivations
+            The training input samples, or their rule activations as
+            returned by ``rule_activations``. Only the columns referenced
+            by the rules are read from a DataFrame or a structured array
+            (whose fields are the features), without copying the others.
 
         Returns
         -------
@@ -439,27 +935,11 @@ class SkopeRules(BaseEstimator):
             null scores represent inliers.
 
         """
-        # Check if fit had been called
-        check_is_fitted(self, ['rules_', 'estimators_', 'estimators_samples_',
-                               'max_samples_'])
-
-        # Input validation
-        X = check_array(X)
-
-        if X.shape[1] != self.n_features_:
-            raise ValueError("X.shape[1] = %d should be equal to %d, "
-                             "the number of features at training time."
-                             " Please reshape your data."
-                             % (X.shape[1], self.n_features_))
+        activations = self._activations(X)
+        weights = np.array([w[0] for _, w in
+                            self.rules_without_feature_names_], dtype=float)
 
-        df = pandas.DataFrame(X, columns=self.feature_names_)
-        selected_rules = self.rules_without_feature_names_
-
-        scores = np.zeros(X.shape[0])
-        for (r, w) in selected_rules:
-            scores[list(df.query(r).index)] += w[0]
-
-        return scores
+        return activations.weighted_sum(weights)
 
     def rules_vote(self, X):
         """Score representing a vote of the base classifiers (rules).
@@ -469,8 +949,9 @@ class SkopeRules(BaseEstimator):
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            The training input samples.
+        X : array-like, shape (n_samples, n_features) or RuleActivations
+            The training input samples, or their rule activations as
+            returned by ``rule_activations``.
 
         Returns
         -------
@@ -480,27 +961,9 @@ class SkopeRules(BaseEstimator):
             null scores represent inliers.
 
         """
-        # Check if fit had been called
-        check_is_fitted(self, ['rules_', 'estimators_', 'estimators_samples_',
-                               'max_samples_'])
-
-        # Input validation
-        X = check_array(X)
-
-        if X.shape[1] != self.n_features_:
-            raise ValueError("X.shape[1] = %d should be equal to %d, "
-                             "the number of features at training time."
-                             " Please reshape your data."
-                             % (X.shape[1], self.n_features_))
-
-        df = pandas.DataFrame(X, columns=self.feature_names_)
-        selected_rules = self.rules_
+        activations = self._activations(X)
 
-        scores = np.zeros(X.shape[0])
-        for (r, _) in selected_rules:
-            scores[list(df.query(r).index)] += 1
-
-        return scores
+        return activations.count().astype(float)
 
     def score_top_rules(self, X):
         """Score representing an ordering between the base classifiers (rules).
@@ -512,8 +975,9 @@ class SkopeRules(BaseEstimator):
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            The training input samples.
+        X : array-like, shape (n_samples, n_features) or RuleActivations
+            The training input samples, or their rule activations as
+            returned by ``rule_activations``.
 
         Returns
         -------
@@ -522,29 +986,13 @@ class SkopeRules(BaseEstimator):
             Positive scores represent outliers, null scores represent inliers.
 
         """
-        # Check if fit had been called
-        check_is_fitted(self, ['rules_', 'estimators_', 'estimators_samples_',
-                               'max_samples_'])
-
-        # Input validation
-        X = check_array(X)
-
-        if X.shape[1] != self.n_features_:
-            raise ValueError("X.shape[1] = %d should be equal to %d, "
-                             "the number of features at training time."
-                             " Please reshape your data."
-                             % (X.shape[1], self.n_features_))
-
-        df = pandas.DataFrame(X, columns=self.feature_names_)
-        selected_rules = self.rules_without_feature_names_
+        activations = self._activations(X)
 
-        scores = np.zeros(X.shape[0])
-        for (k, r) in enumerate(list((selected_rules))):
-            scores[list(df.query(r[0]).index)] = np.maximum(
-                len(selected_rules) - k,
-                scores[list(df.query(r[0]).index)])
+        # The score is given by the first (most performing) activated rule:
+        first_rule = activations.first_active()
 
-        return scores
+        return np.where(first_rule >= 0, activations.n_rules - first_rule,
+                        0).astype(float)
 
     def predict_top_rules(self, X, n_rules):
         """Predict if a particular sample is an outlier or not,
@@ -552,9 +1000,9 @@ class SkopeRules(BaseEstimator):
 
         Parameters
         ----------
-        X : array-like, shape (n_samples, n_features)
-            The input samples. Internally, it will be converted to
-            ``dtype=np.float32``
+        X : array-like, shape (n_samples, n_features) or RuleActivations
+            The input samples, or their rule activations as returned by
+            ``rule_activations``.
 
         n_rules : int
             The number of rules used for the prediction. If one of the
@@ -567,68 +1015,289 @@ class SkopeRules(BaseEstimator):
             For each observations, tells whether or not (1 or 0) it should
             be considered as an outlier according to the selected rules.
         """
+        # Only the n_rules first rules can decide the prediction:
+        activations = self._activations(X, n_rules=n_rules)
+
+        return np.array(activations.any(n_rules), dtype=int)
+
+    def iter_scores(self, X, method='decision_function', chunk_size=None):
+        """Score X chunk by chunk, with a memory bounded by the chunk size.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features) or iterable of chunks
+            The input samples. Objects with a ``shape`` (arrays, memory-mapped
+            arrays as returned by ``np.load(..., mmap_mode='r')``, pandas
+            DataFrames) are sliced into row chunks, so that only one chunk is
+            converted at a time, lists and tuples being converted to arrays
+            first. Any other iterable is consumed as a stream of such
+            objects, e.g. a generator reading a file by blocks.
+
+        method : str, optional (default='decision_function')
+            The scoring method, one of 'predict', 'decision_function',
+            'rules_vote' and 'score_top_rules'.
+
+        chunk_size : int, optional (default=65536)
+            The maximal number of rows scored at once, a positive integer.
+
+        Yields
+        ------
+        scores : array, shape (n_chunk_samples,)
+            The scores of each chunk, in the order of the rows of X.
+        """
+        if method not in SCORING_METHODS:
+            raise ValueError("method should be one of %s, got %r"
+                             % (SCORING_METHODS, method))
+        if chunk_size is None:
+            chunk_size = DEFAULT_CHUNK_SIZE
+        elif not isinstance(chunk_size, INTEGER_TYPES) or chunk_size < 1:
+            raise ValueError("chunk_size should be a positive integer, got %r"
+                             % chunk_size)
+        score = getattr(self, method)
+        for chunk in self._iter_chunks(X, chunk_size):
+            yield score(chunk)
+
+    def chunked_scores(self, X, method='decision_function', chunk_size=None,
+                       out=None):
+        """Score X chunk by chunk, writing the scores into an array.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features) or iterable of chunks
+            The input samples, see ``iter_scores``.
+
+        method : str, optional (default='decision_function')
+            The scoring method, see ``iter_scores``.
+
+        chunk_size : int, optional (default=65536)
+            The maximal number of rows scored at once.
 
-        return np.array((self.score_top_rules(X) > len(self.rules_) - n_rules),
-                        dtype=int)
+        out : array, shape (n_samples,), optional
+            A preallocated array or memory-mapped array receiving the scores.
+            If None, an array is allocated.
 
-    def _tree_to_rules(self, tree, feature_names):
+        Returns
+        -------
+        out : array, shape (n_samples,)
+            The scores of the input samples.
+        """
+        chunks = []
+        start = 0
+        for scores in self.iter_scores(X, method=method,
+                                       chunk_size=chunk_size):
+            if out is None and hasattr(X, 'shape'):
+                out = np.empty(X.shape[0], dtype=scores.dtype)
+            if out is None:
+                chunks.append(scores)
+            else:
+                out[start:start + len(scores)] = scores
+            start += len(scores)
+
+        if out is None:
+            return (np.concatenate(chunks) if len(chunks) > 0
+                    else np.zeros(0))
+        if start != len(out):
+            raise ValueError("out has %d rows but %d samples were scored."
+                             % (len(out), start))
+        return out
+
+    def _iter_chunks(self, X, chunk_size):
+        """Split X into chunks of at most chunk_size rows."""
+        if isinstance(X, (list, tuple)):
+            X = np.asarray(X)
+        if not hasattr(X, 'shape'):
+            for chunk in X:
+                yield from self._iter_chunks(chunk, chunk_size)
+            return
+
+        for start in range(0, X.shape[0], chunk_size):
+            if hasattr(X, 'iloc'):
+                yield X.iloc[start:start + chunk_size]
+            else:
+                yield X[start:start + chunk_size]
+
+    def rule_activations(self, X):
+        """Evaluate the selected rules once on X.
+
+        The result can be given in place of X to ``predict``,
+        ``decision_function``, ``rules_vote``, ``score_top_rules`` and
+        ``predict_top_rules``, so that several scores are computed from a
+        single evaluation of the rules.
+
+        Parameters
+        ----------
+        X : array-like, shape (n_samples, n_features)
+            The input samples. Only the columns referenced by the rules are
+            read from a DataFrame or a structured array.
+
+        Returns
+        -------
+        activations : RuleActivations, shape (n_samples, n_rules)
+            The packed bit matrix of the rules (in the order of ``rules_``)
+            selecting each sample.
+        """
+        X = self._validate_X_predict(X)
+        return self.compiled_rules_.evaluate_packed(X)
+
+    def _activations(self, X, n_rules=None):
+        """Packed activations of (at least) the `n_rules` first rules."""
+        if isinstance(X, RuleActivations):
+            check_is_fitted(self, ['rules_', 'compiled_rules_'])
+            if X.n_rules != self.compiled_rules_.n_rules:
+                raise ValueError("The activations are computed for %d rules,"
+                                 " but the model has %d rules."
+                                 % (X.n_rules, self.compiled_rules_.n_rules))
+            return X
+
+        X = self._validate_X_predict(X)
+
+        # Evaluate blocks of rows in parallel, the comparisons of numpy
+        # releasing the GIL:
+        n_blocks = min(effective_n_jobs(self.n_jobs),
+                       X.shape[0] // MIN_PARALLEL_BLOCK_SIZE)
+        if n_blocks <= 1:
+            return self.compiled_rules_.evaluate_packed(X, n_rules=n_rules)
+
+        bounds = np.linspace(0, X.shape[0], n_blocks + 1).astype(int)
+        blocks = Parallel(n_jobs=n_blocks, prefer="threads")(
+            delayed(self.compiled_rules_.evaluate_packed)(
+                X[start:stop], n_rules=n_rules)
+            for start, stop in zip(bounds[:-1], bounds[1:]))
+        return RuleActivations(np.vstack([block.bits for block in blocks]),
+                               blocks[0].n_rules)
+
+    def _validate_X_predict(self, X):
+        """Check that the model is fitted and that X can be scored, and bin
+        it when the rules are on bin codes."""
+        # Check if fit had been called
+        check_is_fitted(self, ['rules_', 'estimators_', 'estimators_samples_',
+                               'max_samples_'])
+
+        # Input validation
+        if is_frame(X):
+            n_features = (X.shape[1] if hasattr(X, 'iloc')
+                          else len(X.dtype.names))
+        else:
+            X = check_array(X, accept_sparse=['csr', 'csc'],
+                            dtype=self._input_dtype())
+            n_features = X.shape[1]
+
+        if n_features != self.n_features_:
+            raise ValueError("X.shape[1] = %d should be equal to %d, "
+                             "the number of features at training time."
+                             " Please reshape your data."
+                             % (n_features, self.n_features_))
+
+        # Only the columns referenced by the rules are taken and validated
+        # from DataFrames and structured arrays:
+        if is_frame(X):
+            X = ColumnSubset.from_frame(
+                X, np.unique(self.compiled_rules_.term_feature).tolist())
+            for j, column in X.columns.items():
+                X.columns[j] = check_array(column, ensure_2d=False,
+                                           dtype=self._input_dtype())
+        if getattr(self, 'binner_', None) is None:
+            return X
+        if isinstance(X, ColumnSubset):
+            for j, column in X.columns.items():
+                X.columns[j] = self.binner_.transform_column(column, j)
+            return X
+        if sparse.issparse(X):
+            raise ValueError("n_bins is not supported with sparse input.")
+        return self.binner_.transform(X)
+
+    def _input_dtype(self):
+        """The dtype X is converted to, numerical types being kept."""
+        dtype = getattr(self, 'dtype', None)
+        return 'numeric' if dtype is None else dtype
+
+    @staticmethod
+    def _tree_to_rules(tree, features, max_depths=None):
         """
         Return a list of rules from a tree
 
         Parameters
         ----------
             tree : Decision Tree Classifier/Regressor
-            feature_names: list of variable names
+            features: array of the column indices the tree is built on
+            max_depths: list of int or None, optional
+                If given, the rules of the tree truncated at each of these
+                depths (None for no truncation) are returned, rather than
+                the rules of its leaves.
 
         Returns
         -------
-        rules : list of rules.
+        rules : list of tuples (terms, node)
+            One rule per leaf (and per depth), with the id of the node it
+            ends at in the tree. The terms are tuples (feature, symbol,
+            threshold) where feature is a column index of the training data
+            and threshold a float.
         """
-        # XXX todo: check the case where tree is build on subset of features,
-        # ie max_features != None
-
         tree_ = tree.tree_
-        feature_name = [
-            feature_names[i] if i != _tree.TREE_UNDEFINED else "undefined!"
-            for i in tree_.feature
-        ]
+        feature = tree_.feature
+        threshold = tree_.threshold
+        children_left = tree_.children_left
+        children_right = tree_.children_right
         rules = []
 
-        def recurse(node, base_name):
-            if tree_.feature[node] != _tree.TREE_UNDEFINED:
-                name = feature_name[node]
-                symbol = '<='
-                symbol2 = '>'
-                threshold = tree_.threshold[node]
-                text = base_name + ["{} {} {}".format(name, symbol, threshold)]
-                recurse(tree_.children_left[node], text)
-
-                text = base_name + ["{} {} {}".format(name, symbol2,
-                                                      threshold)]
-                recurse(tree_.children_right[node], text)
-            else:
-                rule = str.join(' and ', base_name)
-                rule = (rule if rule != ''
-                        else ' == '.join([feature_names[0]] * 2))
+        def n_truncated_leaves(depth, is_leaf):
+            # number of truncated trees in which the node is a leaf
+            if max_depths is None:
+                return int(is_leaf)
+            return sum(1 for d in max_depths
+                       if d == depth or (is_leaf and (d is None or d > depth)))
+
+        def recurse(node, terms):
+            is_leaf = feature[node] == _tree.TREE_UNDEFINED
+            for _ in range(n_truncated_leaves(len(terms), is_leaf)):
                 # a rule selecting all is set to "c0==c0"
-                rules.append(rule)
+                rules.append((terms if len(terms) > 0
+                              else [(features[0], '==', features[0])], node))
+            if not is_leaf and (max_depths is None or None in max_depths
+                                or len(terms) < max(max_depths)):
+                f = features[feature[node]]
+                t = float(threshold[node])
+                recurse(children_left[node], terms + [(f, '<=', t)])
+                recurse(children_right[node], terms + [(f, '>', t)])
 
         recurse(0, [])
 
-        return rules if len(rules) > 0 else 'True'
+        return rules
 
-    def _eval_rule_perf(self, rule, X, y):
-        # print(rule)
-        # print(dtypes(rule))
-        detected_index = list(X.query(rule).index)
-        if len(detected_index) <= 1:
-            return (0, 0)
-        y_detected = y[detected_index]
-        true_pos = y_detected[y_detected > 0].sum()
-        if true_pos == 0:
+    @staticmethod
+    def _oob_node_counts(tree, X, y):
+        """Count the samples and the positives of X reaching each node.
+
+        The samples are pushed through the tree once, so that the
+        performance of every rule (node) of the tree is read from these
+        counts instead of being evaluated rule by rule.
+
+        Parameters
+        ----------
+            tree : Decision Tree Classifier/Regressor
+            X : array, shape (n_samples, n_tree_features)
+                The samples, restricted to the features of the tree.
+            y : array of bool, shape (n_samples,)
+                Whether each sample belongs to the target class.
+
+        Returns
+        -------
+        n_samples_node : array, shape (n_nodes,)
+            The number of samples going through each node.
+
+        n_pos_node : array, shape (n_nodes,)
+            The number of positive samples going through each node.
+        """
+        node_indicator = tree.decision_path(X).tocsc()
+        n_samples_node = np.diff(node_indicator.indptr)
+        n_pos_node = node_indicator.T.dot(y.astype(np.intp))
+        return n_samples_node, n_pos_node
+
+    @staticmethod
+    def _eval_rule_perf(n_detected, n_true_pos, n_pos):
+        if n_detected <= 1 or n_true_pos == 0:
             return (0, 0)
-        pos = y[y > 0].sum()
-        return y_detected.mean(), float(true_pos) / pos
+        return float(n_true_pos) / n_detected, float(n_true_pos) / n_pos
 
     def deduplicate(self, rules):
         return [max(rules_set, key=self.f1_score)
@@ -638,6 +1307,14 @@ class SkopeRules(BaseEstimator):
         """Create clusters of rules using a decision tree based
         on the terms of the rules
 
+        The rules are parsed once into sparse rule x feature matrices of the
+        number of terms, the position of the first term and the direction of
+        each feature in each rule. Each split of the tree then counts the
+        terms of the features of its rules with a single sparse sum, and
+        splits them on the direction of the most represented feature: rules
+        with a '<=' term on it, rules with a '>' (or '>=') term on it, and
+        the others.
+
         Parameters
         ----------
         rules : List, List of rules
@@ -649,53 +1326,281 @@ class SkopeRules(BaseEstimator):
                 The different set of rules. Each set should be homogeneous
 
         """
-        def split_with_best_feature(rules, depth, exceptions=[]):
+        n_rules = len(rules)
+        features = {}
+        rule_index, feature_index, directions = [], [], []
+        for i, (rule, _) in enumerate(rules):
+            for term in rule.split(' and '):
+                feature, symbol = term.split(' ')[:2]
+                rule_index.append(i)
+                feature_index.append(
+                    features.setdefault(feature, len(features)))
+                directions.append(
+                    DIRECTION_UPPER if symbol == '<=' else
+                    DIRECTION_LOWER if symbol in ('>', '>=') else
+                    DIRECTION_OTHER)
+        n_features = len(features)
+
+        # One entry per rule and feature: its number of terms, the position
+        # of its first term (from 1) and its strongest direction:
+        rule_index = np.array(rule_index, dtype=np.intp)
+        keys, first_term, inverse, n_terms = np.unique(
+            rule_index * n_features + np.array(feature_index, dtype=np.intp),
+            return_index=True, return_inverse=True, return_counts=True)
+        positions = first_term - np.searchsorted(rule_index,
+                                                 rule_index[first_term]) + 1
+        direction = np.full(len(keys), DIRECTION_OTHER)
+        np.minimum.at(direction, inverse, np.array(directions, dtype=int))
+        rows, columns = np.divmod(keys, max(n_features, 1))
+        shape = (n_rules, n_features)
+        counts = sparse.csr_matrix((n_terms, (rows, columns)), shape=shape)
+        positions = sparse.csr_matrix((positions, (rows, columns)),
+                                      shape=shape)
+        direction = sparse.csr_matrix((direction, (rows, columns)),
+                                      shape=shape)
+
+        def most_represented_feature(indices, exceptions):
+            """The feature with the most terms in the rules, the first one
+            to appear in the rules on ties, or None."""
+            n_terms = np.asarray(counts[indices].sum(axis=0)).ravel()
+            n_terms[exceptions] = 0
+            if n_terms.max(initial=0) == 0:
+                return None
+            candidates = np.flatnonzero(n_terms == n_terms.max())
+            if len(candidates) == 1:
+                return candidates[0]
+            # the first rule having a candidate, then its first term:
+            first = positions[indices][:, candidates].tocsc()
+            first_rules = [first.indices[first.indptr[j]]
+                           for j in range(len(candidates))]
+            first_terms = [first.data[first.indptr[j]]
+                           for j in range(len(candidates))]
+            return candidates[np.lexsort((first_terms, first_rules))[0]]
+
+        def split_with_best_feature(indices, depth, exceptions, leaves):
             """
             Method to find a split of rules given most represented feature
             """
-            if depth == 0:
-                return rules
-
-            rulelist = [rule.split(' and ') for rule, score in rules]
-            terms = [t.split(' ')[0] for term in rulelist for t in term]
-            counter = Counter(terms)
-            # Drop exception list
-            for exception in exceptions:
-                del counter[exception]
-
-            if len(counter) == 0:
-                return rules
+            if len(indices) == 0:
+                return
+            feature = (None if depth == 0
+                       else most_represented_feature(indices, exceptions))
+            if feature is None:
+                leaves.append([rules[i] for i in indices])
+                return
 
-            most_represented_term = counter.most_common()[0][0]
             # Proceed to split
-            rules_splitted = [[], [], []]
-            for rule in rules:
-                if (most_represented_term + ' <=') in rule[0]:
-                    rules_splitted[0].append(rule)
-                elif (most_represented_term + ' >') in rule[0]:
-                    rules_splitted[1].append(rule)
-                else:
-                    rules_splitted[2].append(rule)
-            new_exceptions = exceptions+[most_represented_term]
-            # Choose best term
-            return [split_with_best_feature(ruleset,
-                                            depth-1,
-                                            exceptions=new_exceptions)
-                    for ruleset in rules_splitted]
-
-        def breadth_first_search(rules, leaves=None):
-            if len(rules) == 0 or not isinstance(rules[0], list):
-                if len(rules) > 0:
-                    return leaves.append(rules)
-            else:
-                for rules_child in rules:
-                    breadth_first_search(rules_child, leaves=leaves)
-            return leaves
+            rule_direction = direction[indices][:, feature].toarray().ravel()
+            for selected in [rule_direction == DIRECTION_UPPER,
+                             rule_direction == DIRECTION_LOWER,
+                             ~np.isin(rule_direction, (DIRECTION_UPPER,
+                                                       DIRECTION_LOWER))]:
+                split_with_best_feature(indices[selected], depth - 1,
+                                        exceptions + [feature], leaves)
+
         leaves = []
-        res = split_with_best_feature(rules, self.max_depth_duplication)
-        breadth_first_search(res, leaves=leaves)
+        split_with_best_feature(np.arange(n_rules), self.max_depth_duplication,
+                                [], leaves)
         return leaves
 
+    def _find_similar_coverages(self, rules, X):
+        """Cluster the rules selecting nearly the same samples of X.
+
+        The MinHash signature of the samples selected by each rule is
+        computed on a sample of X, each hash function being a random
+        permutation of the samples. Rules sharing a band of their signature
+        are candidates: each of them is merged with the first representative
+        of the clusters of its bucket such that the estimated Jaccard
+        similarity of their samples, the fraction of equal hashes, is at
+        least `coverage_similarity`, or becomes a representative. Rules
+        selecting no sample are never merged.
+
+        Parameters
+        ----------
+        rules : list of tuples (Rule, (precision, recall, nb))
+            The rules to cluster.
+
+        X : array or sparse matrix, shape (n_samples, n_features)
+            The samples the rules are evaluated on.
+
+        Returns
+        -------
+        rulesets : list of list of rules
+            The clusters of rules, in the order of their first rule.
+        """
+        random_state = check_random_state(self.random_state)
+        n_rules = len(rules)
+        n_samples = X.shape[0]
+        if n_samples > COVERAGE_SAMPLE_SIZE:
+            X = X[np.sort(random_state.choice(n_samples, COVERAGE_SAMPLE_SIZE,
+                                              replace=False))]
+            n_samples = COVERAGE_SAMPLE_SIZE
+        permutations = np.array([random_state.permutation(n_samples)
+                                 for _ in range(MINHASH_SIZE)])
+
+        # The hash of a rule is the lowest rank of its samples, n_samples if
+        # it selects none:
+        signatures = np.full((MINHASH_SIZE, n_rules), n_samples)
+        compiled_rules = CompiledRules([rule for rule, _ in rules])
+        for start in range(0, n_rules, UNIQUE_RULES_BLOCK_SIZE):
+            stop = min(start + UNIQUE_RULES_BLOCK_SIZE, n_rules)
+            rule_index, sample_index = np.nonzero(
+                compiled_rules.evaluate_range(X, start, stop).T)
+            if len(rule_index) == 0:
+                continue
+            first = np.flatnonzero(np.diff(rule_index, prepend=-1))
+            for signature, permutation in zip(signatures, permutations):
+                signature[start + rule_index[first]] = np.minimum.reduceat(
+                    permutation[sample_index], first)
+
+        # Bands of r hashes make pairs of similarity s candidates with
+        # probability 1 - (1 - s ** r) ** n_bands, whose threshold is about
+        # (1 / n_bands) ** (1 / r):
+        rows_per_band = min(
+            range(1, MINHASH_SIZE + 1),
+            key=lambda r: abs((1. / (MINHASH_SIZE // r)) ** (1. / r)
+                              - self.coverage_similarity))
+        n_bands = MINHASH_SIZE // rows_per_band
+
+        parent = np.arange(n_rules)
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        covering = np.flatnonzero(signatures[0] < n_samples)
+        for band in range(n_bands):
+            keys = signatures[band * rows_per_band:
+                              (band + 1) * rows_per_band, covering].T
+            buckets = np.unique(keys, axis=0, return_inverse=True)[1].ravel()
+            order = np.argsort(buckets, kind='stable')
+            bounds = np.flatnonzero(np.diff(buckets[order])) + 1
+            # compare the signature of each rule of a bucket to those of the
+            # representatives of its clusters found so far:
+            for members in np.split(covering[order], bounds):
+                if len(members) < 2:
+                    continue
+                representatives = [members[0]]
+                for member in members[1:]:
+                    root = find(member)
+                    if any(find(r) == root for r in representatives):
+                        continue
+                    similar = np.flatnonzero(
+                        (signatures[:, representatives] ==
+                         signatures[:, [member]]).mean(axis=0)
+                        >= self.coverage_similarity)
+                    if len(similar) > 0:
+                        parent[root] = find(representatives[similar[0]])
+                    else:
+                        representatives.append(member)
+
+        clusters = {}
+        for i in range(n_rules):
+            clusters.setdefault(find(i), []).append(rules[i])
+        return list(clusters.values())
+
     def f1_score(self, x):
         return 2 * x[1][0] * x[1][1] / \
                (x[1][0] + x[1][1]) if (x[1][0] + x[1][1]) > 0 else 0
+
+
+def _parallel_eval_rules(estimators, estimators_samples, estimators_features,
+                         X, y, max_depths=None, aggregate=False):
+    """Private function used to extract the rules of a batch of estimators
+    and to count their OOB true positives, support and positives within a
+    job. If aggregate, the counts of each unique rule are summed, with its
+    number of occurrences."""
+    n_samples = X.shape[0]
+    rules = []
+    for estimator, samples, features in zip(estimators, estimators_samples,
+                                            estimators_features):
+        # Create mask for OOB samples
+        mask = ~indices_to_mask(samples, n_samples)
+        if not mask.any():  # OOB evaluation not possible: doing it in-bag
+            mask = samples
+        rules_from_tree = SkopeRules._tree_to_rules(estimator, features,
+                                                    max_depths)
+
+        y_oob = np.array((y[mask] != 0))
+        n_pos = y_oob.sum()
+        tree_rules = [Rule(r) for r, _ in rules_from_tree]
+        if _is_float32_exact(X.dtype):
+            n_detected, n_true_pos = SkopeRules._oob_node_counts(
+                estimator, (X[mask, :])[:, features], y_oob)
+            nodes = [node for _, node in rules_from_tree]
+            n_detected, n_true_pos = n_detected[nodes], n_true_pos[nodes]
+        else:
+            # The trees compare the values cast to float32: the rules are
+            # evaluated as when scoring instead, on the values themselves.
+            activations = CompiledRules(tree_rules).evaluate(X[mask])
+            n_detected = activations.sum(axis=0)
+            n_true_pos = activations[y_oob].sum(axis=0)
+
+        # Factorize rules and add their OOB counts:
+        rules += [(rule, (n_true_pos[k], n_detected[k], n_pos))
+                  for k, rule in enumerate(tree_rules)]
+
+    return _sum_rules_counts(rules) if aggregate else rules
+
+
+def _is_float32_exact(dtype):
+    """Whether the values of the type are unchanged when cast to float32, so
+    that the trees compare them as the rules do."""
+    return dtype == np.float32 or (dtype.kind in 'biu' and dtype.itemsize <= 2)
+
+
+def _ranked_pairs_gains(levels, pos_level, neg_level, weights,
+                        pos_activations, neg_activations):
+    """Private function used by prune to compute the change of twice the
+    number of well ranked (positive, negative) pairs plus the number of
+    tied pairs when adding each rule's weight to the scores of the samples
+    it activates, the scores taking the sorted distinct values `levels`."""
+    n_levels = len(levels)
+
+    def level_counts(sample_level, rule_activations):
+        # number of samples at each level, activated or not by each rule
+        indicator = sparse.csr_matrix(
+            (np.ones(len(sample_level), dtype=np.int64),
+             (sample_level, np.arange(len(sample_level)))),
+            shape=(n_levels, len(sample_level)))
+        activated = (indicator @ rule_activations).toarray()
+        total = np.bincount(sample_level, minlength=n_levels)
+        return activated, total[:, np.newaxis] - activated
+
+    def ranks(counts, thresholds):
+        # twice the number of samples below each threshold plus the number
+        # of samples at it, the samples of each rule being counted in counts
+        below = np.vstack([np.zeros((1, counts.shape[1]), dtype=np.int64),
+                           np.cumsum(counts, axis=0)])
+        rules = np.broadcast_to(np.arange(counts.shape[1]), thresholds.shape)
+        index = np.searchsorted(levels, thresholds)
+        at_index = np.minimum(index, n_levels - 1)
+        at = np.where(levels[at_index] == thresholds,
+                      counts[at_index, rules], 0)
+        return 2 * below[index, rules] + at
+
+    pos_activated, pos_other = level_counts(pos_level, pos_activations)
+    neg_activated, neg_other = level_counts(neg_level, neg_activations)
+    old = np.broadcast_to(levels[:, np.newaxis], pos_activated.shape)
+    new = levels[:, np.newaxis] + weights
+    # the activated positives overtake the other negatives, and the
+    # activated negatives the other positives:
+    return ((pos_activated * (ranks(neg_other, new) -
+                              ranks(neg_other, old))).sum(axis=0) -
+            (neg_activated * (ranks(pos_other, new) -
+                              ranks(pos_other, old))).sum(axis=0))
+
+
+def _sum_rules_counts(rules):
+    """Sum the OOB counts of the occurrences of each unique rule, with its
+    number of occurrences."""
+    rules_counts = {}
+    for rule, counts in rules:
+        counts = np.array(counts + (1,), dtype=np.int64)
+        if rule in rules_counts:
+            rules_counts[rule] += counts
+        else:
+            rules_counts[rule] = counts
+    return rules_counts
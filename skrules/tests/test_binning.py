@@ -0,0 +1,32 @@
+import numpy as np
+
+from skrules import Rule
+from skrules.binning import QuantileBinner
+from skrules.scoring import CompiledRules
+
+
+def test_quantile_binner():
+    rng = np.random.RandomState(0)
+    X = np.c_[rng.randn(1000), rng.randint(0, 5, 1000)]
+    binner = QuantileBinner(n_bins=10).fit(X)
+    codes = binner.transform(X)
+
+    assert codes.dtype == np.uint8
+    assert codes[:, 0].max() == 9
+    assert np.array_equal(binner.bin_edges_[1], [0.5, 1.5, 2.5, 3.5])
+    assert np.array_equal(codes[:, 1], X[:, 1])
+    assert QuantileBinner(n_bins=300).fit(X).transform(X).dtype == np.uint16
+
+    # a rule on the codes selects the same samples as its translation
+    rule = Rule([(0, '<=', 6.5), (0, '>', 2.5), (1, '>', 0.5)])
+    values_rule = binner.inverse_transform_rule(rule)
+    assert np.array_equal(CompiledRules([rule]).evaluate(codes),
+                          CompiledRules([values_rule]).evaluate(X))
+
+
+def test_integer_thresholds():
+    codes = np.arange(6, dtype=np.uint8)[:, np.newaxis]
+    rules = ['c <= 2.5', 'c > 2.5', 'c > -0.5', 'c <= 300.0', 'c > 4.0']
+    activations = CompiledRules(rules, ['c']).evaluate(codes)
+    expected = CompiledRules(rules, ['c']).evaluate(codes.astype(float))
+    assert np.array_equal(activations, expected)
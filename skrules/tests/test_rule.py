@@ -1,4 +1,5 @@
 from skrules import Rule, replace_feature_name
+from skrules.rule import RuleRenderer
 
 
 def test_rule():
@@ -38,3 +39,27 @@ def test_replace_feature_name():
         "__C__1": "c(4)"
     }
     assert replace_feature_name(rule, replace_dict=replace_dict) == real_rule
+
+
+def test_structured_rule():
+    rule = Rule([(1, '<=', 10.5), (0, '>', 3.0), (1, '<=', 12.0)])
+    assert rule == Rule([(0, '>', 3.0), (1, '<=', 10.5)])
+    assert hash(rule) == hash(Rule([(0, '>', 3.0), (1, '<=', 10.5)]))
+    assert rule.to_string(['a', 'b']) == 'a > 3.0 and b <= 10.5'
+    assert Rule([(2, '==', 2)]).to_string({2: 'c'}) == 'c == c'
+
+
+def test_rule_renderer():
+    names = ['__C__%d' % i for i in range(12)]
+    display_names = ['z', 'b(1)', 'a'] + ['x%d' % i for i in range(3, 12)]
+    rule = Rule([(10, '<=', 1.5), (2, '>', 0.5), (1, '==', 1), (0, '>', 2.0)])
+    renderer = RuleRenderer(names, display_names)
+
+    rule_string, display_string = renderer(rule)
+    assert rule_string == rule.to_string(names)
+    # terms in the order of the generic names, as replace_feature_name does
+    assert display_string == replace_feature_name(
+        rule_string, dict(zip(names, display_names)))
+    assert display_string == ('z > 2.0 and b(1) == b(1) and x10 <= 1.5'
+                              ' and a > 0.5')
+    assert renderer(Rule(list(rule.terms)))[1] is display_string
@@ -0,0 +1,110 @@
+import numpy as np
+import pandas
+
+from skrules.scoring import CompiledRules, RuleActivations
+
+
+def test_compiled_rules_match_query():
+    rng = np.random.RandomState(0)
+    X = rng.randn(200, 3)
+    names = ['a', 'b', 'c']
+    rules = ['a <= 0.1 and b > -0.5',
+             'c > 0.3',
+             'a > -1.0 and a <= 1.0 and c <= 0.0',
+             'b == b']
+    activations = CompiledRules(rules, names).evaluate(X)
+    df = pandas.DataFrame(X, columns=names)
+
+    assert activations.shape == (200, 4)
+    for k, rule in enumerate(rules):
+        expected = np.zeros(200, dtype=bool)
+        expected[list(df.query(rule).index)] = True
+        assert np.array_equal(activations[:, k], expected)
+
+
+def test_compiled_rules_empty():
+    activations = CompiledRules([], ['a']).evaluate(np.zeros((5, 1)))
+    assert activations.shape == (5, 0)
+
+
+def test_packed_kernels():
+    rng = np.random.RandomState(0)
+    for n_rules in [0, 5, 8, 21]:
+        dense = rng.rand(50, n_rules) < 0.2
+        packed = RuleActivations.from_dense(dense)
+        weights = rng.rand(n_rules)
+
+        assert np.array_equal(packed.to_dense(), dense)
+        assert np.array_equal(packed.count(), dense.sum(axis=1))
+        assert np.allclose(packed.weighted_sum(weights), dense.dot(weights))
+        first = [np.flatnonzero(row)[0] if row.any() else -1
+                 for row in dense]
+        assert np.array_equal(packed.first_active(), first)
+        for n in range(n_rules + 1):
+            assert np.array_equal(packed.any(n), dense[:, :n].any(axis=1))
+
+
+def test_evaluate_packed():
+    rng = np.random.RandomState(0)
+    X = rng.randn(100, 2)
+    rules = ['a <= %r and b > %r' % tuple(t)
+             for t in rng.randn(150, 2).tolist()]
+    compiled = CompiledRules(rules, ['a', 'b'])
+
+    assert np.array_equal(compiled.evaluate_packed(X).to_dense(),
+                          compiled.evaluate(X))
+    assert np.array_equal(compiled.evaluate_packed(X, n_rules=70).to_dense(),
+                          compiled.evaluate(X)[:, :70])
+
+
+def test_threshold_index():
+    rng = np.random.RandomState(0)
+    X = rng.randint(-3, 4, size=(300, 2)).astype(float)
+    X[::7, 0] = np.nan
+    thresholds = [-2.5, -1., 0.5, 0.5, 2.]
+    rules = ['a <= %r and b > %r' % (t, u)
+             for t in thresholds for u in thresholds]
+    rules += ['a > %r' % t for t in thresholds] + ['a == a', 'b < 1.0']
+    compiled = CompiledRules(rules, ['a', 'b'])
+
+    # each term shared by several rules is evaluated once
+    assert len(compiled.unique_op) == 4 + 4 + 4 + 2
+    assert np.array_equal(compiled.feature_thresholds[0], [-2.5, -1, 0.5, 2])
+    expected = np.array(
+        [[(x <= t) & (y > u) for t in thresholds for u in thresholds]
+         + [x > t for t in thresholds] + [x == x, y < 1.]
+         for x, y in X])
+    assert np.array_equal(compiled.evaluate(X), expected)
+    assert np.array_equal(compiled.evaluate_packed(X).to_dense(), expected)
+    assert np.array_equal(compiled.evaluate_range(X, 7, 30),
+                          expected[:, 7:30])
+
+
+def test_float32_thresholds():
+    rng = np.random.RandomState(0)
+    X = rng.randn(1000, 1).astype(np.float32)
+    # thresholds between and on float32 values, and beyond their range
+    thresholds = np.r_[X[:20, 0].astype(float),
+                       X[20:40, 0].astype(float) + 1e-9,
+                       X[40:60, 0].astype(float) - 1e-9, 1e39, -1e39]
+    rules = ['x <= %r' % t for t in thresholds.tolist()]
+    rules += ['x > %r' % t for t in thresholds.tolist()]
+    compiled = CompiledRules(rules, ['x'])
+
+    assert np.array_equal(compiled.evaluate(X),
+                          compiled.evaluate(X.astype(np.float64)))
+
+
+def test_sparse_columns():
+    from scipy import sparse
+    rng = np.random.RandomState(0)
+    X = rng.randint(-2, 3, size=(200, 3)) * (rng.rand(200, 3) < 0.3)
+    X = X.astype(float)
+    rules = ['a <= 0.5 and b > -1.0', 'a > -0.5', 'c <= -1.5', 'b == 0.0',
+             'c == c', 'a >= 0.0 and c < 1.0', 'b <= 0.0 and b > 0.0']
+    compiled = CompiledRules(rules, ['a', 'b', 'c'])
+    expected = compiled.evaluate(X)
+    for X_sparse in [sparse.csr_matrix(X), sparse.csc_matrix(X)]:
+        assert np.array_equal(compiled.evaluate(X_sparse), expected)
+        assert np.array_equal(compiled.evaluate_packed(X_sparse).to_dense(),
+                              expected)
@@ -7,8 +7,10 @@ import pytest
 from sklearn.model_selection import ParameterGrid
 from sklearn.datasets import load_iris, make_blobs
 from sklearn.metrics import accuracy_score
+from sklearn.base import clone
 from sklearn.utils import check_random_state
-from skrules import SkopeRules
+from skrules import SkopeRules, Rule
+from skrules.scoring import CompiledRules, RuleActivations
 
 rng = check_random_state(0)
 
@@ -231,3 +233,498 @@ def test_f1_score():
     assert clf.f1_score(rule0) == 0
     assert clf.f1_score(rule1) == 0.5
     assert clf.f1_score(rule2) == 0
+
+
+def test_score_top_rules_first_rule():
+    X, y = make_blobs(n_samples=300, random_state=0, centers=2)
+    clf = SkopeRules(max_depth=[1, 2], precision_min=0.2,
+                     random_state=0).fit(X, y)
+    n_rules = len(clf.rules_)
+    activations = clf.compiled_rules_.evaluate(X)
+    assert n_rules > 1
+
+    # the score is given by the first activated rule
+    expected = np.zeros(X.shape[0])
+    for k in range(n_rules - 1, -1, -1):
+        expected[activations[:, k]] = n_rules - k
+    assert np.array_equal(clf.score_top_rules(X), expected)
+
+    for n in range(n_rules + 2):
+        assert np.array_equal(clf.predict_top_rules(X, n),
+                              activations[:, :n].any(axis=1))
+
+
+def test_rule_activations():
+    X, y = make_blobs(n_samples=300, random_state=0, centers=2)
+    clf = SkopeRules(max_depth=[1, 2, 3], precision_min=0.2,
+                     random_state=0).fit(X, y)
+    activations = clf.rule_activations(X)
+    assert activations.shape == (X.shape[0], len(clf.rules_))
+
+    for method in ['predict', 'decision_function', 'rules_vote',
+                   'score_top_rules']:
+        assert np.array_equal(getattr(clf, method)(activations),
+                              getattr(clf, method)(X))
+    assert np.array_equal(clf.predict_top_rules(activations, 2),
+                          clf.predict_top_rules(X, 2))
+
+    with pytest.raises(ValueError):
+        clf.decision_function(RuleActivations.from_dense(
+            np.ones((3, len(clf.rules_) + 1), dtype=bool)))
+
+
+def test_chunked_scores(tmp_path):
+    X, y = make_blobs(n_samples=300, random_state=0, centers=2)
+    clf = SkopeRules(max_depth=[1, 2], precision_min=0.2,
+                     random_state=0).fit(X, y)
+    path = str(tmp_path / 'X.npy')
+    np.save(path, X)
+    X_mmap = np.load(path, mmap_mode='r')
+
+    for method in ['predict', 'decision_function', 'rules_vote',
+                   'score_top_rules']:
+        expected = getattr(clf, method)(X)
+        chunks = list(clf.iter_scores(X_mmap, method=method, chunk_size=70))
+        assert [len(c) for c in chunks] == [70, 70, 70, 70, 20]
+        assert np.array_equal(np.concatenate(chunks), expected)
+
+        stream = (X[i:i + 100] for i in range(0, 300, 100))
+        assert np.array_equal(
+            clf.chunked_scores(stream, method=method, chunk_size=64),
+            expected)
+        assert np.array_equal(
+            clf.chunked_scores(X.tolist(), method=method, chunk_size=64),
+            expected)
+
+    out = np.lib.format.open_memmap(str(tmp_path / 'scores.npy'), mode='w+',
+                                    dtype=float, shape=(300,))
+    clf.chunked_scores(X_mmap, chunk_size=64, out=out)
+    assert np.array_equal(out, clf.decision_function(X))
+
+    with pytest.raises(ValueError):
+        next(clf.iter_scores(X, method='fit'))
+    for chunk_size in [0, -5, 2.5]:
+        with pytest.raises(ValueError):
+            clf.chunked_scores(X, chunk_size=chunk_size)
+
+
+def test_parallel_scoring():
+    X, y = make_blobs(n_samples=40000, random_state=0, centers=2)
+    clf = SkopeRules(max_depth=[1, 2, 3], precision_min=0.2, max_samples=0.1,
+                     random_state=0).fit(X, y)
+    clf_parallel = clone(clf).set_params(n_jobs=3).fit(X, y)
+
+    for method in ['predict', 'decision_function', 'rules_vote',
+                   'score_top_rules']:
+        assert np.array_equal(getattr(clf_parallel, method)(X),
+                              getattr(clf, method)(X))
+    assert np.array_equal(clf_parallel.predict_top_rules(X, 2),
+                          clf.predict_top_rules(X, 2))
+
+
+def test_parallel_fit():
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    params = dict(max_depth=[1, 3], precision_min=0.2, random_state=0)
+    clf = SkopeRules(**params).fit(X, y)
+    clf_parallel = SkopeRules(n_jobs=2, **params).fit(X, y)
+
+    assert clf_parallel.rules_ == clf.rules_
+
+
+def test_skip_redundant_regressor():
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    params = dict(max_depth=[1, 3], n_estimators=4, precision_min=0.2,
+                  random_state=0)
+    clf = SkopeRules(**params).fit(X, y)
+    clf_skip = SkopeRules(skip_redundant_regressor=True, **params).fit(X, y)
+
+    assert clf.estimators_types_ == ['classifier'] * 8 + ['regressor'] * 8
+    assert clf_skip.estimators_types_ == ['classifier'] * 8
+    assert ([(r, p[:2]) for r, p in clf_skip.rules_] ==
+            [(r, p[:2]) for r, p in clf.rules_])
+
+    # regression trees are still needed with sample weights
+    clf_skip.fit(X, y, sample_weight=np.arange(X.shape[0]))
+    assert clf_skip.estimators_types_.count('regressor') == 8
+
+
+def test_share_depths():
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    params = dict(max_depth=[1, 2], n_estimators=5, precision_min=0.2,
+                  random_state=0)
+    clf = SkopeRules(**params).fit(X, y)
+    clf_shared = SkopeRules(share_depths=True, **params).fit(X, y)
+
+    assert len(clf.estimators_) == 20
+    assert len(clf_shared.estimators_) == 10
+    assert all(e.max_depth == 2 for e in clf_shared.estimators_)
+    assert clf_shared.rules_ == clf.rules_
+
+
+def test_warm_start():
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    params = dict(max_depth=[1, 3], precision_min=0.2, random_state=0)
+    clf = SkopeRules(n_estimators=10, **params).fit(X, y)
+    clf_ws = SkopeRules(n_estimators=5, warm_start=True, **params).fit(X, y)
+    first_estimators = list(clf_ws.estimators_)
+    clf_ws.set_params(n_estimators=10).fit(X, y)
+
+    assert len(clf_ws.estimators_) == len(clf.estimators_) == 40
+    assert all(any(e is first for first in first_estimators)
+               for e in clf_ws.estimators_[:5])
+    assert sorted(r for r, _ in clf_ws.rules_) == sorted(
+        r for r, _ in clf.rules_)
+    perfs = dict(clf.rules_)
+    for rule, perf in clf_ws.rules_:
+        assert np.allclose(perf, perfs[rule])
+
+    # refitting without more trees keeps them and their samples
+    samples = list(clf_ws.estimators_samples_)
+    clf_ws.fit(X, y)
+    assert len(clf_ws.estimators_samples_) == len(clf_ws.estimators_) == 40
+    assert all(np.array_equal(s, s_ws)
+               for s, s_ws in zip(samples, clf_ws.estimators_samples_))
+
+    with pytest.raises(ValueError):
+        clf_ws.set_params(n_estimators=3).fit(X, y)
+    # the trees of a fit without warm start are kept as well
+    clf_cold = SkopeRules(n_estimators=5, **params).fit(X, y)
+    first_estimators = list(clf_cold.estimators_)
+    clf_cold.set_params(warm_start=True, n_estimators=10).fit(X, y)
+    assert all(any(e is first for first in first_estimators)
+               for e in clf_cold.estimators_[:5])
+    assert clf_cold.rules_ == clf_ws.rules_
+
+    # the tallies of the previous trees cannot be aggregated otherwise
+    with pytest.raises(ValueError):
+        clf_ws.set_params(n_estimators=15, aggregation='counts').fit(X, y)
+
+
+def test_partial_fit():
+    X, y = make_blobs(n_samples=600, random_state=0, centers=2)
+    clf = SkopeRules(max_depth=[1, 3], precision_min=0.2,
+                     random_state=0).fit(X[:300], y[:300])
+    activations = clf.compiled_rules_.evaluate(X[300:])
+    rules = [rule for rule, _ in clf.rules_]
+    # the OOB counts of fit, here of the occurrences averaged in rules_
+    oob_counts = clf._candidate_counts.copy()
+    assert np.all(oob_counts[:, 1] > 1)
+
+    clf.partial_fit(X[300:450], y[300:450])
+    clf.partial_fit(X[450:], y[450:])
+    detected = oob_counts[:, 1] + activations.sum(axis=0)
+    true_pos = oob_counts[:, 0] + activations[y[300:] == 1].sum(axis=0)
+    n_pos = oob_counts[:, 2] + (y[300:] == 1).sum()
+    for rule, (precision, recall, _) in clf.rules_:
+        k = rules.index(rule)
+        assert precision == true_pos[k] / detected[k]
+        assert recall == true_pos[k] / n_pos[k]
+    f1_scores = [clf.f1_score(rule) for rule in clf.rules_]
+    assert f1_scores == sorted(f1_scores, reverse=True)
+
+    # a small batch does not discard the evidence of fit
+    n_rules = len(clf.rules_)
+    assert len(clf.partial_fit(X[:1], y[:1]).rules_) == n_rules
+
+    # the thresholds are applied again on the updated statistics
+    clf.set_params(precision_min=0.99).partial_fit(X[:1], y[:1])
+    assert all(precision >= 0.99 for _, (precision, _, _) in clf.rules_)
+    assert np.array_equal(clf.decision_function(X),
+                          clf.compiled_rules_.evaluate(X).dot(
+                              [p for _, (p, _, _) in clf.rules_]))
+
+
+def test_aggregation_counts():
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    params = dict(max_depth=[1, 3], precision_min=0.2, random_state=0)
+    clf = SkopeRules(aggregation='counts', **params).fit(X, y)
+    clf_parallel = SkopeRules(aggregation='counts', n_jobs=2,
+                              **params).fit(X, y)
+    assert clf_parallel.rules_ == clf.rules_
+
+    # pooled statistics, recomputed from the OOB sets of every occurrence
+    rules = {}
+    for estimator, samples, features in zip(clf.estimators_,
+                                            clf.estimators_samples_,
+                                            clf.estimators_features_):
+        mask = np.ones(X.shape[0], dtype=bool)
+        mask[samples] = False
+        for terms, _ in clf._tree_to_rules(estimator, features):
+            rule = Rule(terms).to_string(clf.feature_names_)
+            rules.setdefault(rule, []).append(mask)
+    for rule, (precision, recall, nb) in clf.rules_without_feature_names_:
+        detected = clf.compiled_rules_.evaluate(X)[
+            :, [r for r, _ in clf.rules_without_feature_names_].index(rule)]
+        true_pos = sum((detected & m & (y == 1)).sum() for m in rules[rule])
+        assert nb == len(rules[rule])
+        assert precision == true_pos / sum((detected & m).sum()
+                                           for m in rules[rule])
+        assert recall == true_pos / sum((m & (y == 1)).sum()
+                                        for m in rules[rule])
+
+    with pytest.raises(ValueError):
+        SkopeRules(aggregation='median').fit(X, y)
+
+
+def test_float64_oob_evaluation():
+    # values spaced by less than the float32 precision, some of them between
+    # two consecutive float32 values
+    rng = check_random_state(0)
+    steps = 2 * rng.randint(0, 200, 1000) + (rng.rand(1000) < .3)
+    X = np.c_[2. ** 30 + 128. * steps + 40. * (steps % 2), rng.randn(1000)]
+    y = ((steps // 2) % 5 == 0) | (steps % 2 == 1) & (rng.rand(1000) < .5)
+    for rule_evaluation in ['tree', 'unique']:
+        clf = SkopeRules(n_estimators=1, max_depth=4, precision_min=0.01,
+                         recall_min=0.01, skip_redundant_regressor=True,
+                         rule_evaluation=rule_evaluation,
+                         random_state=1).fit(X, y)
+        oob = np.ones(len(y), dtype=bool)
+        oob[clf.estimators_samples_[0]] = False
+
+        # the performances are those of the rules on the float64 values
+        for rule, perf in clf.rules_without_feature_names_:
+            selected = oob.copy()
+            for feature, symbol, value in Rule(rule).terms:
+                column = X[:, clf.feature_names_.index(feature)]
+                selected &= (column <= value if symbol == '<='
+                             else column > value)
+            n_true_pos = (selected & y).sum()
+            assert perf[:2] == (n_true_pos / selected.sum(),
+                                n_true_pos / (oob & y).sum())
+
+
+def test_rule_evaluation_unique(monkeypatch):
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    for params in [dict(max_depth=3),
+                   dict(max_depth=[1, 2, None], share_depths=True),
+                   dict(max_depth=[1, 3], aggregation='counts'),
+                   dict(max_depth=2, max_samples=1.)]:
+        params.update(precision_min=0.2, random_state=0)
+        clf = SkopeRules(**params).fit(X, y)
+        clf_unique = SkopeRules(rule_evaluation='unique', **params).fit(X, y)
+        assert clf_unique.rules_ == clf.rules_
+
+    # by blocks of fewer rules when there are more samples
+    monkeypatch.setattr('skrules.skope_rules.UNIQUE_RULES_BLOCK_CELLS', 2000)
+    params = dict(max_depth=[1, 3], precision_min=0.2, random_state=0)
+    assert (SkopeRules(rule_evaluation='unique', **params).fit(X, y).rules_
+            == SkopeRules(**params).fit(X, y).rules_)
+
+    # on float64 values which are not float32 values
+    X_fine = 2. ** 30 + 128. * np.round(X * 100) + 40.
+    params = dict(max_depth=[2, 4], precision_min=0.2, random_state=0)
+    assert (SkopeRules(rule_evaluation='unique', **params).fit(X_fine, y)
+            .rules_ == SkopeRules(**params).fit(X_fine, y).rules_)
+
+    with pytest.raises(ValueError):
+        SkopeRules(rule_evaluation='leaf').fit(X, y)
+
+
+def test_n_bins():
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    clf = SkopeRules(n_bins=16, max_depth=[1, 3], precision_min=0.2,
+                     random_state=0).fit(X, y)
+    assert len(clf.rules_) > 0
+    assert clf.binner_.transform(X).dtype == np.uint8
+
+    # the thresholds of the rules are bin edges, and scoring the codes
+    # selects the same samples as the rules on the values
+    for rule, _ in clf.rules_without_feature_names_:
+        for feature, _, value in Rule(rule).terms:
+            j = clf.feature_names_.index(feature)
+            assert float(value) in clf.binner_.bin_edges_[j].tolist()
+    rules = [rule for rule, _ in clf.rules_without_feature_names_]
+    activations = CompiledRules(rules, clf.feature_names_).evaluate(X)
+    assert np.array_equal(clf.rule_activations(X).to_dense(), activations)
+    precisions = [perf[0] for _, perf in clf.rules_]
+    assert np.allclose(clf.decision_function(X), activations.dot(precisions))
+
+    # without loss when every feature has few values
+    X_int = np.round(X).astype(int)
+    params = dict(max_depth=3, precision_min=0.2, random_state=0)
+    assert (SkopeRules(n_bins=64, **params).fit(X_int, y).rules_ ==
+            SkopeRules(**params).fit(X_int, y).rules_)
+
+    # the rule of trees reduced to their root selects all the samples, even
+    # on a constant feature, which has no bin edge
+    X_const = np.c_[np.ones(len(X)), X]
+    clf = SkopeRules(n_bins=16, min_samples_split=len(X) + 1,
+                     precision_min=0.2, random_state=0).fit(X_const, y)
+    assert [rule for rule, _ in clf.rules_] == ['__C__0 == __C__0']
+    assert np.all(clf.rule_activations(X_const).to_dense())
+
+    # numpy integers are valid numbers of bins
+    assert (SkopeRules(n_bins=np.int64(16), **params).fit(X, y).rules_ ==
+            SkopeRules(n_bins=16, **params).fit(X, y).rules_)
+
+    with pytest.raises(ValueError):
+        SkopeRules(n_bins=1).fit(X, y)
+    # sparse input is not binned, neither in fit nor when scoring
+    from scipy import sparse
+    with pytest.raises(ValueError):
+        SkopeRules(n_bins=16).fit(sparse.csr_matrix(X), y)
+    with pytest.raises(ValueError):
+        clf.decision_function(sparse.csr_matrix(X_const))
+
+
+def test_dtype():
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    params = dict(max_depth=[1, 3], precision_min=0.2, random_state=0)
+    clf = SkopeRules(**params).fit(X.astype(np.float32), y)
+    clf_32 = SkopeRules(dtype=np.float32, **params).fit(X, y)
+    assert clf_32.rules_ == clf.rules_
+    assert clf_32._validate_X_predict(X).dtype == np.float32
+    assert np.array_equal(clf_32.decision_function(X),
+                          clf.decision_function(X.astype(np.float32)))
+
+    # the rules select the same samples as the trees on float32 data
+    clf_unique = SkopeRules(dtype=np.float32, rule_evaluation='unique',
+                            **params).fit(X, y)
+    assert clf_unique.rules_ == clf_32.rules_
+
+
+def test_frame_column_subset():
+    pandas = pytest.importorskip('pandas')
+    X, y = make_blobs(n_samples=500, n_features=4, random_state=0, centers=2)
+    clf = SkopeRules(max_depth=2, max_features=1, n_estimators=4,
+                     precision_min=0.2, random_state=0).fit(X, y)
+    used = np.unique(clf.compiled_rules_.term_feature)
+    unused = np.setdiff1d(np.arange(4), used)
+    assert len(unused) > 0
+
+    # the unused columns are neither validated nor read
+    df = pandas.DataFrame(X)
+    df[unused[0]] = 'text'
+    records = np.rec.fromarrays(X.T, names='a,b,c,d')
+    for frame in [df, df.iloc[100:], records]:
+        expected = clf.decision_function(X[-len(frame):])
+        assert np.array_equal(clf.decision_function(frame), expected)
+        assert np.array_equal(clf.rule_activations(frame).to_dense(),
+                              clf.rule_activations(X[-len(frame):]).to_dense())
+    assert np.array_equal(clf.chunked_scores(df, chunk_size=64),
+                          clf.decision_function(X))
+
+    with pytest.raises(ValueError):
+        clf.decision_function(pandas.DataFrame(X[:, 1:]))
+
+
+def test_sparse_input():
+    from scipy import sparse
+    rng = np.random.RandomState(0)
+    X = rng.poisson(0.3, size=(600, 8)) * rng.randn(600, 8)
+    y = (X[:, 0] + X[:, 1] - X[:, 2] > 0.5).astype(int)
+    for rule_evaluation in ['tree', 'unique']:
+        params = dict(max_depth=[2, 3], precision_min=0.2, random_state=0,
+                      rule_evaluation=rule_evaluation)
+        clf = SkopeRules(**params).fit(X, y)
+        for X_sparse in [sparse.csr_matrix(X), sparse.csc_matrix(X)]:
+            clf_sparse = SkopeRules(**params).fit(X_sparse, y)
+            assert clf_sparse.rules_ == clf.rules_
+            assert np.array_equal(clf.decision_function(X_sparse),
+                                  clf.decision_function(X))
+            assert np.array_equal(clf.chunked_scores(X_sparse, chunk_size=64),
+                                  clf.decision_function(X))
+
+    clf_sparse.partial_fit(sparse.csr_matrix(X[:100]), y[:100])
+    clf.partial_fit(X[:100], y[:100])
+    assert clf_sparse.rules_ == clf.rules_
+
+    with pytest.raises(ValueError):
+        SkopeRules(n_bins=8).fit(sparse.csr_matrix(X), y)
+
+
+def test_similarity_tree_feature_names():
+    # features are matched by name, not as substrings of other names
+    rules = [("ba <= 2 and a > 1", (1, 1, 0)),
+             ("ba <= 3 and a > 2", (1, 1, 0)),
+             ("ba > 3 and a > 1", (1, 1, 0)),
+             ("a <= 1 and c > 2", (1, 1, 0)),
+             ("__C__1 <= 1 and __C__11 > 2", (1, 1, 0)),
+             ("__C__11 <= 1", (1, 1, 0))]
+    rulesets = SkopeRules(max_depth_duplication=2)._find_similar_rulesets(
+        rules)
+    assert rulesets == [[rules[3]], [rules[0], rules[1]], [rules[2]],
+                        [rules[5]], [rules[4]]]
+
+
+def test_coverage_similarity():
+    X = np.arange(100.)[:, np.newaxis]
+    rules = [(Rule([(0, '<=', 10.5)]), (0.5, 0.5, 1)),
+             (Rule([(0, '>', 50.5)]), (0.9, 0.9, 1)),
+             (Rule([(0, '<=', 10.7)]), (0.6, 0.6, 1)),
+             (Rule([(0, '>', 51.5)]), (0.8, 0.8, 1)),
+             (Rule([(0, '>', 200.)]), (1., 1., 1)),
+             (Rule([(0, '>', 300.)]), (1., 1., 1))]
+    clf = SkopeRules(coverage_similarity=0.9, random_state=0)
+    # same samples, or Jaccard similarity of 0.98, but rules selecting no
+    # sample are not merged
+    assert clf._find_similar_coverages(rules, X) == [
+        [rules[0], rules[2]], [rules[1], rules[3]], [rules[4]], [rules[5]]]
+    clf.set_params(coverage_similarity=1.)
+    assert len(clf._find_similar_coverages(rules, X)) == 5
+
+    # a large bucket of rules selecting the same samples, whose pairs are not
+    # all compared
+    rules = [(Rule([(0, '<=', 10. + i / 5000.)]), (0.5, 0.5, 1))
+             for i in range(3000)]
+    assert clf._find_similar_coverages(rules, X) == [rules]
+
+    X, y = make_blobs(n_samples=500, random_state=0, centers=2)
+    params = dict(max_depth=[2, 3, 4], precision_min=0.2, random_state=0)
+    clf = SkopeRules(**params).fit(X, y)
+    clf_coverage = SkopeRules(coverage_similarity=1., **params).fit(X, y)
+    assert 0 < len(clf_coverage.rules_) < len(clf.rules_)
+    # no two rules select the same samples
+    activations = clf_coverage.rule_activations(X).to_dense()
+    assert len(np.unique(activations, axis=1).T) == len(clf_coverage.rules_)
+
+    with pytest.raises(ValueError):
+        SkopeRules(coverage_similarity=0.).fit(X, y)
+
+
+def test_prune():
+    from sklearn.metrics import roc_auc_score
+    X, y = make_blobs(n_samples=1000, random_state=1, centers=2,
+                      cluster_std=3.)
+    clf = SkopeRules(max_depth=[2, 3], precision_min=0.2, random_state=0)
+    clf.fit(X[:500], y[:500])
+    n_rules = len(clf.rules_)
+    auc = roc_auc_score(y[500:], clf.decision_function(X[500:]))
+
+    pruned = clone(clf).fit(X[:500], y[:500]).prune(X[500:], y[500:],
+                                                    max_rules=3)
+    assert 0 < len(pruned.rules_) <= 3 < n_rules
+    assert pruned.compiled_rules_.n_rules == len(pruned.rules_)
+    # the kept rules are in their original order
+    rules = [rule for rule, _ in clf.rules_]
+    indices = [rules.index(rule) for rule, _ in pruned.rules_]
+    assert indices == sorted(indices)
+    assert (roc_auc_score(y[500:], pruned.decision_function(X[500:]))
+            >= 0.95 * auc)
+
+    # the rules are those a greedy search computing every AUC selects
+    activations = clf.rule_activations(X[500:]).to_dense()
+    weights = np.array([precision for _, (precision, _, _) in clf.rules_])
+    selected, best_auc = [], 0.5
+    while len(selected) < 5:
+        aucs = [roc_auc_score(y[500:], activations[:, selected + [k]].dot(
+                    weights[selected + [k]])) if k not in selected else 0.
+                for k in range(n_rules)]
+        if max(aucs) <= best_auc:
+            break
+        best_auc = max(aucs)
+        selected.append(int(np.argmax(aucs)))
+    pruned = clone(clf).fit(X[:500], y[:500]).prune(X[500:], y[500:],
+                                                    max_rules=5)
+    assert [rule for rule, _ in pruned.rules_] == [rules[k]
+                                                  for k in sorted(selected)]
+
+    pruned = clone(clf).fit(X[:500], y[:500]).prune(X[500:], y[500:],
+                                                    max_terms=4)
+    assert sum(len(Rule(rule).terms)
+               for rule, _ in pruned.rules_without_feature_names_) <= 4
+    pruned.partial_fit(X[500:], y[500:])
+    assert pruned.compiled_rules_.n_rules == len(pruned.rules_) <= 4
+
+    with pytest.raises(ValueError):
+        clf.prune(X[y == 0], y[y == 0])